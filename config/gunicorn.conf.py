@@ -0,0 +1,63 @@
+"""
+Gunicorn configuration for serving Foorum in production.
+
+    gunicorn -c config/gunicorn.conf.py
+
+FORUM_SERVER_MODE selects how Django is served. "asgi" (the default)
+runs config.asgi on Uvicorn workers: each worker runs an event loop, so
+the async API views wait on the database and other I/O without holding
+a thread. "wsgi" runs config.wsgi on threaded sync workers.
+
+Workers write their Prometheus metrics to PROMETHEUS_MULTIPROC_DIR so
+that /metrics reports the whole server (see forum/metrics.py).
+
+For the full list of settings, see
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+mode = os.environ.get('FORUM_SERVER_MODE', 'asgi')
+if mode == 'wsgi':
+    wsgi_app = 'config.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+elif mode == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    raise ValueError(f"FORUM_SERVER_MODE must be 'asgi' or 'wsgi', not {mode!r}")
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Restart workers that stop responding, and recycle each worker after
+# a number of requests (staggered so they do not all restart at once)
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+max_requests = 1000
+max_requests_jitter = 100
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+# Metrics of all workers are collected in one directory, emptied when
+# the server starts so values from a previous run are not counted
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'foorum-metrics'))
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -16,6 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.conf import settings
 
 urlpatterns = [
@@ -23,4 +24,8 @@ urlpatterns = [
     path("", include("forum.urls")),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+# Serve static files from Django when DEBUG is on. runserver does this
+# by itself, but Gunicorn does not
+urlpatterns += staticfiles_urlpatterns()
\ No newline at end of file
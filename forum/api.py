@@ -0,0 +1,118 @@
+from django.http import JsonResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, set_response_etag)
+from . import likes
+from .models import PATH_SEGMENT_WIDTH, Post
+
+# Serialization for the versioned JSON API (/api/v1/).
+#
+# Post.serialize() builds a dict from a model instance: every row is
+# turned into a Post, its author and board into a User and a Board, and
+# every field is formatted whether the client wants it or not. The API
+# reads rows with values() instead, selecting only the columns behind
+# the requested fields, and turns each row into a dict through a plan
+# made once per request. Most fields copy a column as is; the few that
+# need converting have a function. Timestamps stay datetimes, which
+# JsonResponse's encoder writes in ISO 8601.
+#
+# Clients pick fields with ?fields=id,author,like_count (a sparse
+# fieldset). Without it a post has the fields of Post.serialize().
+# Responses carry an ETag of their body, so a client that sends it back
+# in If-None-Match gets an empty 304 when nothing changed.
+
+
+# Return a thumbnail's URL from its stored name
+def thumb_url(name):
+    if not name:
+        return None
+    return Post._meta.get_field("thumb").storage.url(name)
+
+
+# Return a post's depth in its thread from its path
+def path_depth(path):
+    return len(path) // PATH_SEGMENT_WIDTH - 1
+
+
+# The fields of a post: the values() column each is read from and the
+# function that converts the column, if any
+POST_FIELDS = {
+    "id": ("id", None),
+    "author": ("author__username", None),
+    "board": ("board__name", None),
+    "board_id": ("board_id", None),
+    "parent": ("parent_id", None),
+    "content": ("content", None),
+    "thumb": ("thumb", thumb_url),
+    "video": ("video", None),
+    "like_count": ("like_count", None),
+    "comment_count": ("comment_count", None),
+    "timestamp": ("timestamp", None),
+    "depth": ("path", path_depth),
+    "liked": ("viewer_liked", None),
+}
+DEFAULT_FIELDS = (
+    "id", "author", "board", "parent", "content", "thumb", "video",
+    "like_count", "comment_count", "timestamp",
+)
+
+
+# Parse the fields parameter, a comma-separated list of field names.
+# Raises ValueError for unknown fields
+def parse_fields(value):
+    if not value:
+        return DEFAULT_FIELDS
+    names = list(dict.fromkeys(
+        name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in POST_FIELDS]
+    if unknown or not names:
+        raise ValueError(
+            f"Unknown fields: {', '.join(unknown)}. Fields are "
+            f"{', '.join(POST_FIELDS)}.")
+    return names
+
+
+# Return a post queryset as values() rows holding the columns of the
+# given fields, of the queryset's ordering (read by the cursor
+# paginator) and any extra columns
+def post_values(queryset, fields, user, *extra):
+    columns = {POST_FIELDS[name][0] for name in fields}
+    columns.update(extra)
+    if "liked" in fields:
+        queryset = queryset.with_viewer_liked(user)
+
+        # Pending likes are applied by post ID and adjust the count
+        columns.update(("id", "like_count"))
+    columns.update(name.lstrip("-") for name in queryset.query.order_by)
+    return queryset.values(*sorted(columns))
+
+
+# Include the viewer's likes that are still buffered in rows read with
+# the liked field
+async def apply_pending_likes(rows, fields, user):
+    if "liked" in fields and user.is_authenticated and rows:
+        likes.apply(rows, await likes.apending(
+            user.pk, [row["id"] for row in rows]))
+
+
+# Serialize values() rows with the given fields
+def serialize_posts(rows, fields):
+    plan = [(name, *POST_FIELDS[name]) for name in fields]
+    return [
+        {
+            name: convert(row[column]) if convert else row[column]
+            for name, column, convert in plan
+        }
+        for row in rows
+    ]
+
+
+# Return compact JSON with an ETag of its body, or an empty 304 if the
+# request's If-None-Match already has it. Responses depend on the
+# viewer, so caches must revalidate them and may not share them
+def json_response(request, data):
+    response = JsonResponse(
+        data, json_dumps_params={"separators": (",", ":")})
+    set_response_etag(response)
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(
+        request, etag=response.headers["ETag"], response=response)
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ForumConfig(AppConfig):
     name = 'forum'
+
+    # Connect the signal handlers that keep denormalized data in sync,
+    # and install the query instrumentation before any connection opens
+    def ready(self):
+        from . import instrumentation, signals  # noqa: F401
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from . import metrics
+
+# Cached pages are invalidated with version keys. Every
+# namespace a page depends on ("boards", "board:<id>", "user:<name>",
+# "thread:<id>") has a version number stored in the cache, and the page's
+# cache key includes those versions. Changing a board or post bumps the
+# affected versions, so stale pages are never read again and simply
+# expire, with no need to find and delete them. Versions start from the
+# current time so that a version evicted from the cache is never reused.
+#
+# Rendered post bodies are cached with Django's {% cache %} tag, varied
+# on every value they render, so an edit changes their key instead.
+
+# Hit and miss counts for this process, by cache kind ("page")
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def record(kind, hit):
+    result = "hit" if hit else "miss"
+    with _stats_lock:
+        _stats[(kind, result)] += 1
+    metrics.CACHE_REQUESTS.labels(kind, result).inc()
+
+
+# Return the hit and miss counts and hit ratio of each cache kind
+def stats():
+    with _stats_lock:
+        counts = dict(_stats)
+    result = {}
+    for kind in sorted({kind for kind, _ in counts}):
+        hits = counts.get((kind, "hit"), 0)
+        misses = counts.get((kind, "miss"), 0)
+        result[kind] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0
+        }
+    return result
+
+
+def version_key(name):
+    return f"forum:version:{name}"
+
+
+# Return the current versions of the given namespaces, creating any
+# that are missing
+def get_versions(names):
+    keys = [version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+# Invalidate everything cached under the given namespaces
+def bump(*names):
+    for name in set(names):
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.set(version_key(name), time.time_ns(), None)
+
+
+# Build a cache key from arbitrary parts
+def make_key(prefix, *parts):
+    digest = hashlib.md5(
+        "\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"forum:{prefix}:{digest}"
+
+
+# Decorator that caches a view's full response for anonymous GET
+# requests. namespaces is called with the view's URL arguments and
+# returns the version namespaces the page depends on. The key also
+# includes the query string, so each board sort and page is cached
+# separately
+def cache_anonymous_page(namespaces):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            names = namespaces(*args, **kwargs)
+            key = make_key(
+                "page", request.path,
+                sorted(request.GET.lists()), *get_versions(names))
+            response = cache.get(key)
+            record("page", response is not None)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+
+            # Pages that set cookies or embed a CSRF token belong to
+            # one visitor and must not be shared
+            if response.status_code == 200 and not response.streaming \
+                    and not response.cookies \
+                    and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE"):
+                cache.set(key, response, settings.FORUM_PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
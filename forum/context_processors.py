@@ -0,0 +1,7 @@
+from django.conf import settings
+
+
+# Expose the fragment cache timeout to the {% cache %} tags that cache
+# rendered post bodies
+def cache_timeouts(request):
+    return {"fragment_cache_timeout": settings.FORUM_FRAGMENT_CACHE_TIMEOUT}
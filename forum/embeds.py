@@ -0,0 +1,110 @@
+import logging
+import re
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from embed_video.backends import EmbedVideoException, detect_backend
+from . import cache as page_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Metadata of embedded videos and songs. When a post is saved with a
+# video link, a background task detects the provider with
+# django-embed-video, asks the provider's oEmbed endpoint for the title
+# and thumbnail, and records the result in the post's video_meta field:
+#
+#   {"source": "https://youtu.be/...", "provider": "youtube",
+#    "embed_url": "https://www.youtube.com/embed/...",
+#    "thumbnail": "https://i.ytimg.com/...", "title": "..."}
+#
+# Pages render the stored metadata as a click-to-load facade, so no
+# provider is contacted while rendering and no iframe loads until the
+# reader asks for it. "source" is the link the metadata was resolved
+# from; an edited link shows as a plain link until it is resolved.
+
+OEMBED_ENDPOINTS = {
+    "youtube": "https://www.youtube.com/oembed",
+    "vimeo": "https://vimeo.com/api/oembed.json",
+    "soundcloud": "https://soundcloud.com/oembed",
+}
+IFRAME_SRC_PATTERN = re.compile(r'src="(?P<url>[^"]+)"', re.I)
+
+
+# Return True if the post's video link has not been resolved yet
+def needs_metadata(post):
+    return bool(post.video) and post.video_meta.get("source") != post.video
+
+
+# Fetch a provider's oEmbed response for a URL. Responses are cached,
+# failures for a shorter time, so each link is looked up at most once
+# per cache period however many posts share it. Returns None if the
+# provider does not know the URL
+def fetch_oembed(endpoint, url):
+    key = page_cache.make_key("oembed", endpoint, url)
+    data = cache.get(key)
+    if data is None:
+        try:
+            response = requests.get(
+                endpoint,
+                params={"url": url, "format": "json"},
+                timeout=settings.FORUM_OEMBED_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            cache.set(key, data, settings.FORUM_OEMBED_CACHE_TIMEOUT)
+        except (requests.RequestException, ValueError):
+            logger.warning("oEmbed lookup failed for %s", url, exc_info=True)
+            data = {}
+            cache.set(key, data, settings.FORUM_OEMBED_CACHE_TIMEOUT // 24)
+    return data or None
+
+
+# Resolve a video link into its provider, embed URL, thumbnail and
+# title. Links no backend recognises resolve to the source alone and
+# are shown as plain links
+def resolve(url):
+    meta = {"source": url}
+    try:
+        backend = detect_backend(url)
+    except EmbedVideoException:
+        return meta
+    provider = backend.backend.removesuffix("Backend").lower()
+    data = fetch_oembed(OEMBED_ENDPOINTS[provider], url) \
+        if provider in OEMBED_ENDPOINTS else None
+    data = data or {}
+
+    # Prefer the player URL from the provider's embed code (the only
+    # source for SoundCloud) and fall back to the backend's URL pattern
+    match = IFRAME_SRC_PATTERN.search(data.get("html", ""))
+    if match:
+        embed_url = match.group("url")
+    elif backend.pattern_url:
+        try:
+            embed_url = str(backend.url)
+        except EmbedVideoException:
+            return meta
+    else:
+        return meta
+    meta.update({
+        "provider": provider,
+        "embed_url": embed_url,
+        "thumbnail": data.get("thumbnail_url"),
+        "title": data.get("title", "")
+    })
+    return meta
+
+
+# Background task: resolve and store the metadata of a post's video
+def resolve_video(pk):
+    post = Post.objects.filter(pk=pk).first()
+    if post is None or not needs_metadata(post):
+        return
+    meta = resolve(post.video)
+
+    # Record the metadata unless the link was edited meanwhile, and
+    # invalidate the cached pages that show the post
+    updated = Post.objects.filter(pk=pk, video=post.video) \
+        .update(video_meta=meta)
+    if updated:
+        from .signals import post_namespaces
+        page_cache.bump(*post_namespaces(pk))
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from . import metrics
+from .models import PATH_SEGMENT_WIDTH, Post
+
+logger = logging.getLogger(__name__)
+
+# Live updates of boards and threads over server-sent events.
+#
+# Board and thread pages open an event stream subscribed to the channel
+# of their board ("board:<id>") or post ("thread:<id>"). New posts, new
+# comments and like counts are published to the channels of the pages
+# that show them once their transaction commits.
+#
+# Fan-out is batched at both ends. An event is read from the database
+# and encoded once, by the process that wrote it, and the broker
+# carries the encoded event to every server process. Each process
+# subscribes to the broker once and hands the same encoded event to
+# all of its streams, with one callback per event loop, so a thread
+# with thousands of watchers costs one query and one message per event
+# rather than one per watcher. Likes are coalesced further: the posts
+# liked or unliked in the last FORUM_EVENTS_LIKE_INTERVAL seconds are
+# read in one query, and one message per channel carries their counts.
+#
+# The broker is pluggable (FORUM_EVENTS_BROKER). LocalBroker delivers
+# events within the process, which suits a single server process and
+# tests. RedisBroker uses Redis pub/sub so that every process of every
+# node sees every event. Streams are only served by the ASGI server,
+# which holds them open without a thread each.
+
+# Events a stream may fall behind by before it is closed. The browser
+# reconnects after RETRY_MS milliseconds
+MAX_BACKLOG = 100
+RETRY_MS = 5000
+
+# Local streams by channel
+_subscriptions = defaultdict(set)
+_lock = threading.Lock()
+_broker = None
+
+# Posts whose like counts changed since the last publish
+_liked = set()
+_publisher_pid = None
+
+
+# One local event stream. Events are queued on the stream's event loop
+# until it reads them
+class Subscription:
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.events = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    # Queue an encoded event. Runs on the stream's event loop
+    def deliver(self, message):
+        if len(self.events) >= MAX_BACKLOG:
+            self.closed = True
+        else:
+            self.events.append(message)
+        self.ready.set()
+
+    # Wait up to timeout seconds for events and return those queued
+    async def get(self, timeout):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+def subscribe(channel):
+    subscription = Subscription(channel)
+    with _lock:
+        _subscriptions[channel].add(subscription)
+    broker().listen()
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        subscribers = _subscriptions.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscriptions[subscription.channel]
+
+
+# Hand an encoded event to the local streams of a channel. Called from
+# any thread, with one callback per event loop for all of its streams
+def dispatch(channel, message):
+    with _lock:
+        subscribers = list(_subscriptions.get(channel, ()))
+    by_loop = defaultdict(list)
+    for subscription in subscribers:
+        by_loop[subscription.loop].append(subscription)
+    for loop, batch in by_loop.items():
+        try:
+            loop.call_soon_threadsafe(deliver, batch, message)
+        except RuntimeError:
+            pass
+
+
+def deliver(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+# Yield the server-sent events of a channel until the client goes away
+# or falls too far behind. A comment line is sent every
+# FORUM_EVENTS_HEARTBEAT seconds to keep idle connections open
+async def stream(channel):
+    subscription = subscribe(channel)
+    metrics.LIVE_STREAMS.inc()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while not subscription.closed:
+            messages = await subscription.get(
+                settings.FORUM_EVENTS_HEARTBEAT)
+            yield "".join(messages) if messages else ": heartbeat\n\n"
+    finally:
+        unsubscribe(subscription)
+
+
+# Delivers events within this process only
+class LocalBroker:
+
+    def __init__(self, url=""):
+        pass
+
+    # Events only need to be read from the database if a local stream
+    # could receive them
+    def active(self):
+        return bool(_subscriptions)
+
+    def publish(self, messages):
+        for channel, message in messages:
+            dispatch(channel, message)
+
+    def listen(self):
+        pass
+
+
+# Delivers events to every process through Redis pub/sub. Requires the
+# redis package. Each process runs one listener thread subscribed to
+# every channel and dispatches to its local streams
+class RedisBroker:
+    prefix = "forum:events:"
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as error:
+            raise ImproperlyConfigured(
+                "RedisBroker requires the redis package.") from error
+        self.client = redis.Redis.from_url(url)
+        self.listener_pid = None
+        self.lock = threading.Lock()
+
+    def active(self):
+        return True
+
+    # Publish a batch of events in one round trip
+    def publish(self, messages):
+        pipeline = self.client.pipeline(transaction=False)
+        for channel, message in messages:
+            pipeline.publish(self.prefix + channel, message)
+        pipeline.execute()
+
+    # Start this process's listener thread on first use. A forked
+    # Gunicorn worker does not inherit its parent's thread, so it
+    # starts its own
+    def listen(self):
+        with self.lock:
+            if self.listener_pid == os.getpid():
+                return
+            self.listener_pid = os.getpid()
+        threading.Thread(
+            target=self.receive, name="forum-events", daemon=True).start()
+
+    def receive(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + "*")
+                for item in pubsub.listen():
+                    channel = item["channel"].decode()[len(self.prefix):]
+                    dispatch(channel, item["data"].decode())
+            except Exception:
+                logger.exception("Reading live events from Redis failed")
+                time.sleep(1)
+
+
+# Return the configured broker, creating it on first use
+def broker():
+    global _broker
+    with _lock:
+        if _broker is None:
+            _broker = import_string(settings.FORUM_EVENTS_BROKER)(
+                settings.FORUM_EVENTS_URL)
+        return _broker
+
+
+# Encode an event in the server-sent events format
+def encode(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Return the channels of the pages that show a post: the threads of its
+# ancestors (and of the post itself, with include_self) and, for
+# top-level posts, the board
+def channels(board_id, parent_id, path, include_self=False):
+    ids = [
+        int(path[start:start + PATH_SEGMENT_WIDTH])
+        for start in range(0, len(path), PATH_SEGMENT_WIDTH)
+    ]
+    if not include_self:
+        ids = ids[:-1]
+    names = [f"thread:{post_id}" for post_id in ids]
+    if parent_id is None:
+        names.append(f"board:{board_id}")
+    return names
+
+
+# Publish encoded events, logging rather than raising on failure: the
+# writes they announce have already committed
+def publish(messages):
+    if not messages:
+        return
+    try:
+        broker().publish(messages)
+    except Exception:
+        logger.exception("Publishing live events failed")
+
+
+# Announce a new post or comment once the current transaction commits
+def post_created(post_id):
+    transaction.on_commit(lambda: publish_post(post_id))
+
+
+def publish_post(post_id):
+    if not broker().active():
+        return
+    post = Post.objects.select_related("author", "board") \
+        .filter(pk=post_id).first()
+    if post is None:
+        return
+    kind = "post" if post.parent_id is None else "comment"
+    message = encode(kind, post.serialize())
+    metrics.LIVE_EVENTS.labels(kind).inc()
+    publish([
+        (channel, message)
+        for channel in channels(post.board_id, post.parent_id, post.path)
+    ])
+
+
+# Announce the new like counts of posts once the current transaction
+# commits. Counts are published every FORUM_EVENTS_LIKE_INTERVAL
+# seconds, or right away if the interval is 0
+def likes_changed(post_ids):
+    post_ids = set(post_ids)
+    transaction.on_commit(lambda: queue_likes(post_ids))
+
+
+def queue_likes(post_ids):
+    if not settings.FORUM_EVENTS_LIKE_INTERVAL:
+        publish_likes(post_ids)
+        return
+    with _lock:
+        _liked.update(post_ids)
+    start_publisher()
+
+
+# Read the like counts of posts in one query and publish one message
+# per channel with the counts of every post it shows
+def publish_likes(post_ids):
+    if not post_ids or not broker().active():
+        return
+    counts = defaultdict(dict)
+    posts = Post.objects.filter(pk__in=post_ids).values(
+        "id", "board_id", "parent_id", "path", "like_count")
+    for post in posts:
+        for channel in channels(post["board_id"], post["parent_id"],
+                                post["path"], include_self=True):
+            counts[channel][post["id"]] = post["like_count"]
+    metrics.LIVE_EVENTS.labels("likes").inc(len(counts))
+    publish([
+        (channel, encode("likes", {"counts": channel_counts}))
+        for channel, channel_counts in counts.items()
+    ])
+
+
+# Start this process's like publisher thread on first use
+def start_publisher():
+    global _publisher_pid
+    with _lock:
+        if _publisher_pid == os.getpid():
+            return
+        _publisher_pid = os.getpid()
+    threading.Thread(
+        target=publish_periodically, name="forum-like-events",
+        daemon=True).start()
+
+
+def publish_periodically():
+    while True:
+        time.sleep(settings.FORUM_EVENTS_LIKE_INTERVAL)
+        with _lock:
+            post_ids = set(_liked)
+            _liked.clear()
+        if not post_ids:
+            continue
+        close_old_connections()
+        try:
+            publish_likes(post_ids)
+        except Exception:
+            logger.exception("Publishing like counts failed")
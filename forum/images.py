@@ -0,0 +1,98 @@
+import os
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+from . import cache
+
+# Responsive renditions of uploaded images. After a post, comment or
+# board is saved with a new image, a background task decodes the
+# original once and writes a resized copy at each width in
+# FORUM_IMAGE_WIDTHS, in WebP and (where Pillow supports it) AVIF. The
+# results are recorded in the object's thumb_meta field:
+#
+#   {"source": "photo.jpg", "width": 4032, "height": 3024,
+#    "renditions": [{"name": "renditions/photo-320w.webp",
+#                    "format": "webp", "width": 320, "height": 240}, ...]}
+#
+# "source" is the image the renditions were made from. Templates only
+# use renditions whose source matches the current image, so an edited
+# post falls back to its original image until the new renditions exist.
+
+FORMATS = [
+    ("avif", "AVIF", {"quality": 60}),
+    ("webp", "WEBP", {"quality": 80, "method": 4}),
+]
+
+
+def available_formats():
+    return [
+        (extension, pillow_format, options)
+        for extension, pillow_format, options in FORMATS
+        if features.check(extension)
+    ]
+
+
+# Return True if the object's image has no renditions yet
+def needs_renditions(instance):
+    return bool(instance.thumb) and \
+        instance.thumb_meta.get("source") != instance.thumb.name
+
+
+# Background task: generate the renditions of an object's image
+def generate_renditions(model_label, pk):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_renditions(instance):
+        return
+    source = instance.thumb.name
+    storage = instance.thumb.storage
+    with storage.open(source, "rb") as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    # Never upscale; an image narrower than the smallest width gets
+    # one rendition at its own size
+    widths = [w for w in settings.FORUM_IMAGE_WIDTHS if w < image.width]
+    widths = widths or [image.width]
+    stem = os.path.splitext(os.path.basename(source))[0]
+    renditions = []
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for extension, pillow_format, options in available_formats():
+            buffer = BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            name = storage.save(
+                f"renditions/{stem}-{width}w.{extension}",
+                ContentFile(buffer.getvalue()))
+            renditions.append({
+                "name": name,
+                "format": extension,
+                "width": width,
+                "height": height
+            })
+
+    # Record the renditions unless the image was replaced meanwhile, and
+    # invalidate the cached pages that show the object
+    meta = {
+        "source": source,
+        "width": image.width,
+        "height": image.height,
+        "renditions": renditions
+    }
+    updated = model.objects.filter(pk=pk, thumb=source) \
+        .update(thumb_meta=meta)
+    if updated:
+        cache.bump(*namespaces(instance))
+
+
+def namespaces(instance):
+    from .signals import post_namespaces
+    if instance._meta.model_name == "board":
+        return ["boards", f"board:{instance.pk}"]
+    return post_namespaces(instance.pk)
@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import random
+import re
+import time
+import traceback
+from collections import Counter
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+from . import metrics
+
+# Per-request instrumentation. InstrumentationMiddleware records, for a
+# sampled fraction of requests (FORUM_INSTRUMENTATION_SAMPLE_RATE), the
+# number of SQL queries, the time spent in the database and in template
+# rendering, and queries repeated with the same shape (the signature of
+# an N+1 loop). The figures are sent back in a Server-Timing header and
+# logged as one JSON line per request to the "forum.requests" logger.
+#
+# Every request, sampled or not, counts and times its queries for the
+# request metrics (forum/metrics.py), and a query slower than
+# FORUM_SLOW_QUERY_MS is logged to "forum.slow_queries" with the view
+# and the project code that issued it.
+#
+# Queries are observed with an execute wrapper installed on every
+# database connection. The request being recorded is kept in a context
+# variable, which follows async views into the threads their queries
+# run in.
+
+request_logger = logging.getLogger("forum.requests")
+slow_query_logger = logging.getLogger("forum.slow_queries")
+
+_current = ContextVar("forum_request_recorder", default=None)
+
+PLACEHOLDER_LIST_PATTERN = re.compile(r"\((?:%s|\?)(?:, (?:%s|\?))+\)")
+SAVEPOINT_PATTERN = re.compile(r'"s\d+_x\d+"')
+
+
+# Return the shape of a query, so that queries differing only in their
+# parameters (or the length of an IN list) compare equal
+def fingerprint(sql):
+    sql = PLACEHOLDER_LIST_PATTERN.sub("(...)", sql)
+    return SAVEPOINT_PATTERN.sub('"savepoint"', sql)
+
+
+# Collects the queries and timings of one request
+class Recorder:
+
+    def __init__(self, request, sampled):
+        self.request = request
+        self.sampled = sampled
+        self.view = None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.rendering = 0
+        self.shapes = Counter()
+
+    def record(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if duration * 1000 >= settings.FORUM_SLOW_QUERY_MS:
+            self.log_slow_query(sql, duration)
+        if self.sampled:
+            self.shapes[fingerprint(sql)] += 1
+
+    # Query shapes run at least FORUM_DUPLICATE_QUERY_THRESHOLD times,
+    # most repeated first
+    def duplicates(self):
+        return [
+            {"sql": sql, "count": count}
+            for sql, count in self.shapes.most_common()
+            if count >= settings.FORUM_DUPLICATE_QUERY_THRESHOLD
+        ]
+
+    def log_slow_query(self, sql, duration):
+        slow_query_logger.warning(json.dumps({
+            "duration_ms": round(duration * 1000, 3),
+            "sql": sql,
+            "view": self.view,
+            "path": self.request.path,
+            "stack": project_stack(),
+        }))
+
+    def server_timing(self, total):
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f"tpl;dur={self.template_time * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+
+    def summary(self, response, total):
+        return {
+            "method": self.request.method,
+            "path": self.request.path,
+            "view": self.view,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 3),
+            "queries": self.queries,
+            "db_ms": round(self.db_time * 1000, 3),
+            "template_ms": round(self.template_time * 1000, 3),
+            "duplicates": self.duplicates(),
+        }
+
+
+# Return the frames of the current stack that belong to the project,
+# innermost last, skipping Django and other installed packages
+def project_stack():
+    base = str(settings.BASE_DIR)
+    return [
+        f"{os.path.relpath(frame.filename, base)}:{frame.lineno} "
+        f"in {frame.name}"
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base)
+        and "site-packages" not in frame.filename
+        and frame.filename != __file__
+    ]
+
+
+# Execute wrapper installed on every connection. Times each query of a
+# request and passes other queries (management commands, background
+# tasks) straight through
+def execute_wrapper(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.record(sql, time.perf_counter() - start)
+
+
+def install_wrapper(sender, connection, **kwargs):
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+connection_created.connect(install_wrapper)
+
+
+# Records each request. Works in both sync and async middleware chains,
+# so async views are not switched to a thread on its account
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(recorder, response)
+
+    async def __acall__(self, request):
+        recorder, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(recorder, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = _current.get()
+        if recorder is not None:
+            recorder.view = request.resolver_match.view_name
+
+    def start(self, request):
+        sampled = random.random() < settings.FORUM_INSTRUMENTATION_SAMPLE_RATE
+        recorder = Recorder(request, sampled)
+        return recorder, _current.set(recorder)
+
+    def finish(self, recorder, response):
+        total = time.perf_counter() - recorder.started
+        metrics.observe_request(
+            recorder.view, recorder.request.method, response.status_code,
+            total, recorder.queries)
+        if not recorder.sampled:
+            return response
+        timing = recorder.server_timing(total)
+        if response.has_header("Server-Timing"):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response["Server-Timing"] = timing
+        request_logger.info(json.dumps(recorder.summary(response, total)))
+        return response
+
+
+# Django template backend that adds the time spent rendering templates
+# to the request being recorded. Queries run while rendering (lazy
+# querysets evaluated by the template) count as database time only
+class DjangoTemplates(django_backend.DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        recorder = _current.get()
+        if recorder is None or not recorder.sampled or recorder.rendering:
+            return self.template.render(context, request)
+        recorder.rendering += 1
+        start = time.perf_counter()
+        db_time = recorder.db_time
+        try:
+            return self.template.render(context, request)
+        finally:
+            recorder.rendering -= 1
+            recorder.template_time += time.perf_counter() - start - \
+                (recorder.db_time - db_time)
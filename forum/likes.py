@@ -0,0 +1,228 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from . import events, metrics, writer
+from .models import Post, User
+from .signals import invalidate, post_namespaces
+
+logger = logging.getLogger(__name__)
+
+# Write-behind buffering of likes.
+#
+# With FORUM_LIKE_BUFFER set, the like routes do not write to the
+# database. Each like or unlike is recorded in a buffer in the server
+# process, keyed by user and post, so repeated clicks on the same post
+# collapse into the last one. A background thread flushes the buffer
+# every FORUM_LIKE_FLUSH_INTERVAL seconds, or as soon as it holds
+# FORUM_LIKE_BUFFER_SIZE entries, in one transaction: a query to find
+# which likes already exist, one bulk insert, one bulk delete, one
+# counter update per post whose count changed and one update of their
+# scores. Popular posts get one counter update per flush instead of one
+# per click.
+#
+# The latest like state of each pending (user, post) is also stored in
+# the cache, and the like routes apply it on top of what the database
+# says, so users see their own likes and counts before they are
+# flushed. With a shared cache (FORUM_CACHE_URL) this holds across
+# server processes, and a flush writes the latest state even when it
+# was recorded by another process. Other users see a like once it is
+# flushed. Likes buffered when a process is killed without a chance to
+# shut down are lost.
+
+PENDING_TIMEOUT = 300
+
+_buffer = {}
+_lock = threading.Lock()
+_wake = threading.Event()
+_flusher_pid = None
+
+
+def pending_key(user_id, post_id):
+    return f"forum:like:{user_id}:{post_id}"
+
+
+# Record that a user likes (liked=True) or no longer likes a post
+def buffer(user_id, post_id, liked):
+    with _lock:
+        _buffer[(user_id, post_id)] = liked
+        full = len(_buffer) >= settings.FORUM_LIKE_BUFFER_SIZE
+    cache.set(pending_key(user_id, post_id), liked, PENDING_TIMEOUT)
+    start_flusher()
+    if full:
+        _wake.set()
+
+
+# Return the like states of the given posts that the user changed and
+# that may not be flushed yet, as a dict of post ID to liked
+def pending(user_id, post_ids):
+    if not settings.FORUM_LIKE_BUFFER:
+        return {}
+    keys = {pending_key(user_id, post_id): post_id for post_id in post_ids}
+    return merge(user_id, keys, cache.get_many(keys))
+
+
+async def apending(user_id, post_ids):
+    if not settings.FORUM_LIKE_BUFFER:
+        return {}
+    keys = {pending_key(user_id, post_id): post_id for post_id in post_ids}
+    return merge(user_id, keys, await cache.aget_many(keys))
+
+
+# The cache holds the latest state; the buffer covers cache evictions
+def merge(user_id, keys, cached):
+    with _lock:
+        states = {
+            post_id: _buffer[(user_id, post_id)]
+            for post_id in keys.values() if (user_id, post_id) in _buffer
+        }
+    states.update({keys[key]: liked for key, liked in cached.items()})
+    return states
+
+
+# Apply pending like states to posts given as dicts with "id",
+# "viewer_liked" and "like_count", adjusting the counts to match
+def apply(posts, states):
+    for post in posts:
+        liked = states.get(post["id"])
+        if liked is not None and liked != post["viewer_liked"]:
+            post["like_count"] += 1 if liked else -1
+            post["viewer_liked"] = liked
+    return posts
+
+
+# Like or unlike a post for a user, through the buffer when buffering
+# is enabled and directly otherwise
+async def aset_liked(user, post_id, liked):
+    if settings.FORUM_LIKE_BUFFER:
+        buffer(user.pk, post_id, liked)
+    elif liked:
+        await user.alike(post_id)
+    else:
+        await user.aunlike(post_id)
+
+
+# Toggle the user's like on a post and return whether it is now liked
+def toggle(user, post_id):
+    if not settings.FORUM_LIKE_BUFFER:
+        return writer.write(user.toggle_like, post_id)
+    liked = pending(user.pk, [post_id]).get(post_id)
+    if liked is None:
+        liked = User.likes.through.objects \
+            .filter(user_id=user.pk, post_id=post_id).exists()
+    buffer(user.pk, post_id, not liked)
+    return not liked
+
+
+# Write the buffered likes to the database and return how many were
+# flushed. The writes go through the writer queue, except at shutdown
+# (inline=True) when the queue no longer accepts work. If the write
+# fails, the likes go back into the buffer unless newer ones replaced
+# them
+def flush(inline=False):
+    with _lock:
+        intents = dict(_buffer)
+        _buffer.clear()
+    if not intents:
+        return 0
+    try:
+        if inline:
+            save(intents)
+        else:
+            writer.write(save, intents)
+    except Exception:
+        with _lock:
+            for key, liked in intents.items():
+                _buffer.setdefault(key, liked)
+        raise
+    return len(intents)
+
+
+@transaction.atomic
+def save(intents):
+    Like = User.likes.through
+
+    # Another process may have recorded a newer state since
+    keys = {pending_key(*key): key for key in intents}
+    for cache_key, liked in cache.get_many(keys).items():
+        intents[keys[cache_key]] = liked
+
+    existing = {
+        (user_id, post_id): pk
+        for pk, user_id, post_id in Like.objects.filter(
+            user_id__in={user_id for user_id, _ in intents},
+            post_id__in={post_id for _, post_id in intents})
+        .values_list("pk", "user_id", "post_id")
+    }
+
+    # Likes of users and posts deleted since are dropped
+    user_ids = set(User.objects.filter(
+        pk__in={user_id for user_id, _ in intents})
+        .values_list("pk", flat=True))
+    post_ids = set(Post.objects.filter(
+        pk__in={post_id for _, post_id in intents})
+        .values_list("pk", flat=True))
+    added = [
+        (user_id, post_id) for (user_id, post_id), liked in intents.items()
+        if liked and (user_id, post_id) not in existing
+        and user_id in user_ids and post_id in post_ids
+    ]
+    removed = [
+        key for key, liked in intents.items()
+        if not liked and key in existing
+    ]
+    Like.objects.bulk_create(
+        [Like(user_id=user_id, post_id=post_id)
+         for user_id, post_id in added],
+        ignore_conflicts=True)
+    Like.objects.filter(pk__in=[existing[key] for key in removed]).delete()
+
+    changes = Counter()
+    for _, post_id in added:
+        changes[post_id] += 1
+    for _, post_id in removed:
+        changes[post_id] -= 1
+    for post_id, change in changes.items():
+        if change:
+            Post.objects.filter(pk=post_id) \
+                .update(like_count=F("like_count") + change)
+            invalidate(post_namespaces(post_id))
+    changed = [post_id for post_id, change in changes.items() if change]
+    Post.objects.filter(pk__in=changed).refresh_scores()
+    if changed:
+        events.likes_changed(changed)
+    metrics.LIKES.labels("like").inc(len(added))
+    metrics.LIKES.labels("unlike").inc(len(removed))
+
+
+# Start this process's flusher thread on first use. A forked Gunicorn
+# worker does not inherit its parent's thread, so it starts its own. A
+# flush interval of 0 leaves flushing to explicit flush() calls
+def start_flusher():
+    global _flusher_pid
+    if not settings.FORUM_LIKE_FLUSH_INTERVAL:
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(
+        target=flush_periodically, name="forum-like-flusher",
+        daemon=True).start()
+    atexit.register(flush, inline=True)
+
+
+def flush_periodically():
+    while True:
+        _wake.wait(settings.FORUM_LIKE_FLUSH_INTERVAL)
+        _wake.clear()
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Flushing buffered likes failed")
@@ -0,0 +1,239 @@
+import json
+import statistics
+import subprocess
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from forum.models import User, Post, Board
+from forum.pagination import CursorPaginator
+from forum.views import BOARD_SORTS, DEFAULT_SORT
+from .loadtest import percentile
+
+
+# Benchmarks the forum's pages and JSON API in process, with Django's
+# test client, against whatever data the configured database holds
+# (see generate_dataset). Each endpoint is requested --warmup times,
+# then timed over --requests requests, and one more request counts its
+# SQL queries. The report records throughput, latency percentiles and
+# query counts per endpoint, with the commit and dataset size, so runs
+# on different commits can be compared: pass a previous report as
+# --baseline to include the change of each figure.
+#
+# Endpoints are aimed at the busiest board, thread, author and
+# follower, and board pages are requested with every sort and deep in
+# the feed. Signed-in requests bypass the anonymous page cache.
+class Command(BaseCommand):
+    help = "Measure throughput, latency and query counts of the forum " \
+           "endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=50,
+            help="Number of timed requests per endpoint.")
+        parser.add_argument(
+            "--warmup", type=int, default=5,
+            help="Number of untimed requests per endpoint.")
+        parser.add_argument(
+            "--depth", type=int, default=100,
+            help="Page number of the deep board pages.")
+        parser.add_argument(
+            "--only", nargs="+", default=[],
+            help="Only benchmark endpoints whose name starts with one of "
+                 "these prefixes.")
+        parser.add_argument(
+            "--baseline",
+            help="A previous report to compare the results with.")
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username="benchmark")
+        paths = endpoints(user, options["depth"])
+        if options["only"]:
+            paths = {
+                name: endpoint for name, endpoint in paths.items()
+                if name.startswith(tuple(options["only"]))
+            }
+        anonymous = Client()
+        signed_in = Client()
+        signed_in.force_login(user)
+
+        # The test client sends requests for the "testserver" host
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            results = {}
+            for name, (method, path, authenticated) in paths.items():
+                results[name] = measure(
+                    anonymous if not authenticated else signed_in,
+                    method, path, options["warmup"], options["requests"])
+                self.stderr.write(
+                    f"{name}: {results[name]['p50_ms']} ms p50, "
+                    f"{results[name]['queries']} queries")
+
+        report = {
+            "commit": commit(),
+            "vendor": connection.vendor,
+            "dataset": {
+                "users": User.objects.count(),
+                "boards": Board.objects.count(),
+                "posts": Post.objects.filter(parent=None).count(),
+                "comments": Post.objects.exclude(parent=None).count(),
+                "likes": User.likes.through.objects.count(),
+                "follows": User.following.through.objects.count(),
+            },
+            "requests": options["requests"],
+            "results": results,
+        }
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                report["changes"] = compare(json.load(f), results)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+
+# Return the endpoints to benchmark as {name: (method, path, signed
+# in)}, aimed at the busiest board, thread, author and follower
+def endpoints(user, depth):
+    board = Board.objects.annotate(size=Count("posts")) \
+        .order_by("-size", "id").first()
+    if board is None or not board.posts.exists():
+        raise CommandError(
+            "No posts to benchmark. Use generate_dataset first.")
+    thread = Post.objects.filter(parent=None) \
+        .order_by("-comment_count", "id").first()
+    author = User.objects.annotate(size=Count("posts")) \
+        .order_by("-size", "id").first()
+    follower = User.objects.annotate(size=Count("following")) \
+        .order_by("-size", "id").first()
+
+    # The benchmark user follows the same accounts as the busiest
+    # follower, so the Following page has a full timeline
+    user.following.set(follower.following.all())
+    recent = ",".join(str(pk) for pk in Post.objects.order_by("-id")
+                      .values_list("id", flat=True)[:20])
+    board_path = f"/board/{board.id}"
+
+    paths = {
+        "index": ("GET", "/", False),
+        "index_signed_in": ("GET", "/", True),
+        "view_board": ("GET", board_path, False),
+    }
+    for sort, ordering in BOARD_SORTS.items():
+        cursor = deep_cursor(board, ordering, depth)
+        paths[f"view_board_{sort}"] = ("GET", f"{board_path}?q={sort}", True)
+        paths[f"view_board_{sort}_deep"] = (
+            "GET", f"{board_path}?q={sort}&cursor={cursor}", True)
+    paths.update({
+        "view_board_page_deep": (
+            "GET", f"{board_path}?page={depth}", True),
+        "view_comments": ("GET", f"/board/post/{thread.id}", True),
+        "view_user": ("GET", f"/{author.username}", False),
+        "view_user_signed_in": ("GET", f"/{author.username}", True),
+        "view_following": ("GET", "/following", True),
+        "api_board_feed": ("GET", f"/forum/boards/{board.id}/posts", True),
+        "api_board_feed_deep": (
+            "GET",
+            f"/forum/boards/{board.id}/posts"
+            f"?cursor={deep_cursor(board, DEFAULT_SORT, depth)}",
+            True),
+        "api_v1_board_posts": (
+            "GET", f"/api/v1/boards/{board.id}/posts", True),
+        "api_v1_board_posts_sparse": (
+            "GET",
+            f"/api/v1/boards/{board.id}/posts?fields=id,like_count",
+            True),
+        "api_v1_thread": ("GET", f"/api/v1/posts/{thread.id}/thread", True),
+        "api_v1_user_posts": (
+            "GET", f"/api/v1/users/{author.username}/posts", True),
+        "api_v1_following": ("GET", "/api/v1/following", True),
+        "api_post": ("GET", f"/forum/{thread.id}", True),
+        "api_like_states": ("GET", f"/forum/posts/likes?ids={recent}", True),
+        "api_search": ("GET", "/forum/search?q=music", True),
+        "api_like": ("TOGGLE", f"/forum/{thread.id}/like", True),
+    })
+    return paths
+
+
+# Return the cursor of the board page with the given number, found by
+# reading the key of the row just before it
+def deep_cursor(board, ordering, depth):
+    posts = board.posts.filter(parent=None).order_by(*ordering)
+    paginator = CursorPaginator(posts, 10)
+    row = posts[max(0, (depth - 1) * 10 - 1):].first()
+    return paginator.encode_cursor(row, True) if row else ""
+
+
+# Time requests to an endpoint and count the queries of one of them.
+# "TOGGLE" alternates POST and DELETE so a write endpoint leaves the
+# data as it found it
+def measure(client, method, path, warmup, count):
+    def send(i):
+        if method == "TOGGLE":
+            method_name = "post" if i % 2 == 0 else "delete"
+        else:
+            method_name = method.lower()
+        response = getattr(client, method_name)(path)
+        if response.status_code >= 400:
+            raise CommandError(
+                f"{method} {path} returned {response.status_code}.")
+
+    for i in range(warmup):
+        send(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        send(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    elapsed = time.perf_counter() - started
+    with CaptureQueriesContext(connection) as queries:
+        send(count)
+    query_count = len(queries)
+    if method == "TOGGLE" and count % 2 == 0:
+        send(count + 1)
+    latencies.sort()
+    return {
+        "requests_per_second": round(count / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p90_ms": round(percentile(latencies, 90), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "queries": query_count,
+    }
+
+
+# Return the relative change of each figure from a baseline report, as
+# a fraction (-0.25 is 25% lower)
+def compare(baseline, results):
+    changes = {}
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        changes[name] = {
+            key: round((value - before[key]) / before[key], 3)
+            for key, value in result.items()
+            if before.get(key)
+        }
+    return changes
+
+
+# Return the checked out commit, if the project is a git checkout
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
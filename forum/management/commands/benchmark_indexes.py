@@ -0,0 +1,179 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from forum.models import User, Post, Board
+
+
+# Benchmarks the feed query shapes with and without the indexes declared
+# on Post.Meta. For each query the command records the database's query
+# plan (EXPLAIN) and timings, first with the indexes in place ("after"),
+# then with them temporarily dropped ("before"). Works against whichever
+# database is configured, so run it once on SQLite and once on
+# PostgreSQL to compare.
+#
+# --seed fills the database with synthetic rows first. Only run this
+# against a throwaway database.
+class Command(BaseCommand):
+    help = "Record EXPLAIN plans and timings of the feed queries " \
+           "with and without the Post indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Number of posts to generate before benchmarking.")
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of times each query is timed.")
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            seed(options["seed"])
+        analyze()
+        queries = feed_queries()
+        if not queries:
+            self.stderr.write("No posts to benchmark. Use --seed.")
+            return
+        report = {
+            "vendor": connection.vendor,
+            "posts": Post.objects.count(),
+            "after": run(queries, options["repeat"])
+        }
+
+        # Drop the indexes, measure again and restore them
+        indexes = Post._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Post, index)
+        try:
+            analyze()
+            report["before"] = run(queries, options["repeat"])
+        finally:
+            with connection.schema_editor() as editor:
+                for index in indexes:
+                    editor.add_index(Post, index)
+            analyze()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+
+# Build one queryset per feed query shape, aimed at the busiest board,
+# author and thread so the plans reflect the worst case
+def feed_queries():
+    board = Board.objects.annotate(total=Count("posts")) \
+        .order_by("-total").first()
+    author = User.objects.annotate(total=Count("posts")) \
+        .order_by("-total").first()
+    thread = Post.objects.filter(parent=None) \
+        .order_by("-comment_count").first()
+    follower = User.objects.annotate(total=Count("following")) \
+        .order_by("-total").first()
+    if board is None or thread is None:
+        return {}
+    top_level = Post.objects.filter(parent=None)
+    board_posts = top_level.filter(board=board)
+    middle = board_posts.order_by("-timestamp") \
+        .values_list("timestamp", flat=True)[board.total // 2:][:1]
+    return {
+        "board_newest": board_posts.order_by("-timestamp", "-id"),
+        "board_oldest": board_posts.order_by("timestamp", "id"),
+        "board_deep_page": board_posts
+            .filter(timestamp__lt=middle.first() or timezone.now())
+            .order_by("-timestamp", "-id"),
+        "board_likes": board_posts.order_by("-like_count", "-id"),
+        "board_comments": board_posts.order_by("-comment_count", "-id"),
+        "profile": top_level.filter(author=author)
+            .order_by("-timestamp", "-id"),
+        "following": top_level
+            .filter(author__in=follower.following.all())
+            .order_by("-timestamp", "-id"),
+        "thread": Post.objects.filter(parent=thread)
+            .order_by("-timestamp", "-id"),
+    }
+
+
+# Explain and time the first page of every query
+def run(queries, repeat):
+    results = {}
+    for name, queryset in queries.items():
+        page = queryset[:10]
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(page.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            "plan": page.explain(),
+            "median_ms": round(statistics.median(timings), 3),
+            "min_ms": round(min(timings), 3),
+        }
+    return results
+
+
+# Refresh the planner's statistics
+def analyze():
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+# Generate users, boards, posts, comments and follows in bulk
+def seed(total_posts, batch_size=5000):
+    rng = random.Random(0)
+    start = User.objects.count()
+    users = User.objects.bulk_create([
+        User(username=f"bench{start + i}")
+        for i in range(max(10, total_posts // 100))
+    ])
+    boards = Board.objects.bulk_create([
+        Board(name=f"Bench board {i}") for i in range(10)
+    ])
+    for user in users[:50]:
+        user.following.add(*rng.sample(users, min(50, len(users))))
+
+    # Three quarters of the rows are top-level posts and the rest are
+    # comments on earlier posts
+    now = timezone.now()
+    parents = []
+    created = 0
+    while created < total_posts:
+        batch = []
+        for i in range(min(batch_size, total_posts - created)):
+            parent = rng.choice(parents) if parents and rng.random() < 0.25 \
+                else None
+            batch.append(Post(
+                author=rng.choice(users),
+                board=parent.board if parent else rng.choice(boards),
+                parent=parent,
+                content="Benchmark post",
+                like_count=int(rng.paretovariate(1.5)),
+            ))
+        batch = Post.objects.bulk_create(batch)
+        parents.extend(post for post in batch if post.parent is None)
+        created += len(batch)
+
+    # auto_now_add stamps every row with the current time, so spread the
+    # timestamps over the past year, then fill in the comment counters
+    posts = list(Post.objects.filter(content="Benchmark post").only("id"))
+    for post in posts:
+        post.timestamp = now - timedelta(seconds=rng.randrange(31536000))
+    Post.objects.bulk_update(posts, ["timestamp"], batch_size=batch_size)
+    call_command("rebuild_counters", stdout=StringIO())
@@ -0,0 +1,113 @@
+import json
+import statistics
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext
+from forum import api
+from forum.models import Post
+from .benchmark_endpoints import commit
+
+
+# Measures how fast posts are read and serialized to JSON, in rows per
+# second, with each of the ways the forum serializes posts:
+#
+# - "instances_lazy": Post.serialize() on plain instances, loading the
+#   author and board of each post on first use
+# - "instances": Post.serialize() on instances read with their author
+#   and board joined, as the older JSON routes do
+# - "values": the versioned API's values() rows and field plan (see
+#   forum/api.py), with the fields given by --fields
+#
+# Each method reads the newest --rows posts and encodes them --repeat
+# times. The report gives the median rows per second of the whole
+# (query, serialization and JSON encoding) and of serialization and
+# encoding alone, and the number of queries of one run.
+class Command(BaseCommand):
+    help = "Measure the serialization throughput of posts in rows/sec."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=1000,
+            help="Number of posts per run.")
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Number of timed runs per method.")
+        parser.add_argument(
+            "--fields", default="",
+            help="Fields of the values method, as in the API's fields "
+                 "parameter.")
+
+    def handle(self, *args, **options):
+        try:
+            fields = api.parse_fields(options["fields"])
+        except ValueError as error:
+            raise CommandError(error)
+        posts = Post.objects.order_by("-id")[:options["rows"]]
+        if not posts.exists():
+            raise CommandError(
+                "No posts to benchmark. Use generate_dataset first.")
+        methods = {
+            "instances_lazy": lambda: serialize_instances(posts),
+            "instances": lambda: serialize_instances(
+                posts.select_related("author", "board")),
+            "values": lambda: serialize_values(posts, fields),
+        }
+        results = {}
+        for name, method in methods.items():
+            results[name] = measure(method, options["repeat"])
+            self.stderr.write(
+                f"{name}: {results[name]['rows_per_second']} rows/sec, "
+                f"{results[name]['queries']} queries")
+        self.stdout.write(json.dumps({
+            "commit": commit(),
+            "vendor": connection.vendor,
+            "rows": options["rows"],
+            "fields": list(fields),
+            "results": results,
+        }, indent=2))
+
+
+# Each method reads its rows, then returns a function that serializes
+# and encodes them, so the two can be timed apart
+def serialize_instances(posts):
+    rows = list(posts.all())
+    return lambda: json.dumps(
+        [post.serialize() for post in rows], cls=DjangoJSONEncoder)
+
+
+def serialize_values(posts, fields):
+    rows = list(api.post_values(posts, fields, AnonymousUser()))
+    return lambda: json.dumps(
+        api.serialize_posts(rows, fields), cls=DjangoJSONEncoder,
+        separators=(",", ":"))
+
+
+# Time a method over repeated runs and count the queries of one run.
+# Lazy loading happens during serialization, so the queries are
+# counted over both steps. With DEBUG on, the timed runs may have filled
+# the connection's query log, which would hide the count
+def measure(method, repeat):
+    totals = []
+    encodings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode = method()
+        encode_start = time.perf_counter()
+        output = encode()
+        end = time.perf_counter()
+        totals.append(end - start)
+        encodings.append(end - encode_start)
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        method()()
+    rows = len(json.loads(output))
+    return {
+        "rows_per_second": round(rows / statistics.median(totals), 1),
+        "serialize_rows_per_second": round(
+            rows / statistics.median(encodings), 1),
+        "bytes": len(output),
+        "queries": len(queries),
+    }
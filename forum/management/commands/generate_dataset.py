@@ -0,0 +1,256 @@
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from forum.models import User, Post, Board, path_segment
+
+Like = User.likes.through
+Follow = User.following.through
+
+
+# Fills the database with a synthetic forum shaped like a real one, for
+# benchmarking. Activity follows power laws: a few users attract most
+# followers and write most posts, a few boards get most of the traffic
+# and a few posts collect most likes and comments. Posts are spread
+# over --days days up to now, and comments always follow their post.
+#
+# Rows are written with bulk inserts in --batch-size batches, then the
+# counters, timelines and search index are rebuilt. Runs are repeatable
+# for a given --seed. Only run this against a throwaway database.
+class Command(BaseCommand):
+    help = "Generate a large synthetic forum for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users", type=int, default=10000,
+            help="Number of users.")
+        parser.add_argument(
+            "--boards", type=int, default=50,
+            help="Number of boards.")
+        parser.add_argument(
+            "--posts", type=int, default=1000000,
+            help="Number of posts and comments.")
+        parser.add_argument(
+            "--comment-ratio", type=float, default=0.6,
+            help="Fraction of posts that are comments.")
+        parser.add_argument(
+            "--likes", type=float, default=3.0,
+            help="Average number of likes per post.")
+        parser.add_argument(
+            "--follows", type=float, default=20.0,
+            help="Average number of accounts each user follows.")
+        parser.add_argument(
+            "--days", type=int, default=365,
+            help="Number of days the posts are spread over.")
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="Random seed.")
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Number of rows per insert.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        generator = Generator(options)
+        for step in ("users", "boards", "follows", "posts"):
+            step_started = time.perf_counter()
+            with transaction.atomic():
+                count = getattr(generator, f"create_{step}")()
+            self.stdout.write(
+                f"Created {count} {step} in "
+                f"{time.perf_counter() - step_started:.1f} seconds.")
+
+        # Fill in the derived data the bulk inserts skipped
+        for command, *args in (("rebuild_counters",),
+                               ("rescore_posts", "--all"),
+                               ("rebuild_timelines",), ("reindex_search",)):
+            step_started = time.perf_counter()
+            call_command(command, *args, stdout=StringIO())
+            self.stdout.write(
+                f"Ran {command} in "
+                f"{time.perf_counter() - step_started:.1f} seconds.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated the dataset in "
+            f"{time.perf_counter() - started:.1f} seconds."))
+
+
+# Return cumulative weights for n items whose popularity falls off as
+# 1 / rank^exponent, for random.choices()
+def zipf_weights(n, exponent=1.0):
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+# Pareto-distributed count with roughly the given mean: most users
+# follow a few accounts and most posts get a few likes, while a few get
+# hundreds
+def pareto_count(rng, mean):
+    return int(mean / 3 * rng.paretovariate(1.5))
+
+
+# bulk_create() stamps auto_now_add fields with the current time.
+# Switch that off while generating so posts keep their timestamps
+@contextmanager
+def explicit_timestamps():
+    field = Post._meta.get_field("timestamp")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Generator:
+
+    def __init__(self, options):
+        self.options = options
+        self.batch_size = options["batch_size"]
+        self.rng = random.Random(options["seed"])
+        self.prefix = f"gen{options['seed']}_"
+
+    def create_users(self):
+        start = User.objects.filter(username__startswith=self.prefix).count()
+        users = User.objects.bulk_create(
+            [
+                User(username=f"{self.prefix}{start + i}")
+                for i in range(self.options["users"])
+            ],
+            batch_size=self.batch_size)
+
+        # Rank users by popularity (followers) and by activity (posts,
+        # likes) independently
+        self.user_ids = [user.pk for user in users]
+        self.popular = self.rng.sample(self.user_ids, len(self.user_ids))
+        self.active = self.rng.sample(self.user_ids, len(self.user_ids))
+        self.user_weights = zipf_weights(len(self.user_ids))
+        return len(users)
+
+    def create_boards(self):
+        boards = Board.objects.bulk_create([
+            Board(name=f"Board {i}", description="Generated board")
+            for i in range(self.options["boards"])
+        ])
+        self.board_ids = [board.pk for board in boards]
+        self.board_weights = zipf_weights(len(self.board_ids))
+        return len(boards)
+
+    # Each user follows a Pareto-distributed number of accounts, picked
+    # by popularity, so follower counts follow a power law
+    def create_follows(self):
+        total = 0
+        batch = []
+        for user_id in self.user_ids:
+            count = min(pareto_count(self.rng, self.options["follows"]),
+                        len(self.user_ids) - 1)
+            targets = self.pick_users(self.popular, count, exclude=user_id)
+            batch.extend(
+                Follow(from_user_id=user_id, to_user_id=target)
+                for target in targets)
+            if len(batch) >= self.batch_size:
+                total += self.insert(Follow, batch)
+                batch = []
+        return total + self.insert(Follow, batch)
+
+    # Posts are generated oldest first. Each top-level post gets a
+    # Pareto-distributed number of slots in a window of recent posts,
+    # and a comment replies to a random slot, so a few threads draw
+    # most of the comments. Some comments get a slot too and draw
+    # replies of their own. IDs and thread paths are assigned here so
+    # that comments can reply to posts in the same batch. Comments get
+    # fewer likes
+    def create_posts(self):
+        total = self.options["posts"]
+        now = timezone.now()
+        start = now - timedelta(days=self.options["days"])
+        step = (now - start) / max(total, 1)
+        first_id = (Post.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        recent = deque(maxlen=10000)
+        created = 0
+        with explicit_timestamps():
+            while created < total:
+                size = min(self.batch_size, total - created)
+                batch = []
+                for i in range(created, created + size):
+                    parent = None
+                    if recent and \
+                            self.rng.random() < self.options["comment_ratio"]:
+                        parent = recent[self.rng.randrange(len(recent))]
+                    post = Post(
+                        id=first_id + i,
+                        author_id=self.rng.choices(
+                            self.active, cum_weights=self.user_weights)[0],
+                        board_id=parent[1] if parent else self.rng.choices(
+                            self.board_ids, cum_weights=self.board_weights)[0],
+                        parent_id=parent[0] if parent else None,
+                        path=(parent[2] if parent else "") +
+                        path_segment(first_id + i),
+                        content=f"Generated post {i} about "
+                                f"{self.rng.choice(WORDS)} and "
+                                f"{self.rng.choice(WORDS)}",
+                        timestamp=start + step * i)
+                    if parent is None:
+                        slots = min(int(self.rng.paretovariate(1.2)), 500)
+                        recent.extend(
+                            [(post.id, post.board_id, post.path)] * slots)
+                    elif self.rng.random() < 0.3 and \
+                            post.depth < Post.MAX_DEPTH:
+                        recent.append((post.id, post.board_id, post.path))
+                    batch.append(post)
+                posts = Post.objects.bulk_create(batch)
+                self.create_likes(posts)
+                created += size
+
+        # Move the ID sequence past the explicit IDs (PostgreSQL)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Post]):
+                cursor.execute(sql)
+        return created
+
+    def create_likes(self, posts):
+        likes = []
+        for post in posts:
+            mean = self.options["likes"]
+            if post.parent_id is not None:
+                mean /= 3
+            count = min(pareto_count(self.rng, mean), len(self.user_ids))
+            likers = self.pick_users(self.active, count)
+            likes.extend(
+                Like(user_id=user_id, post_id=post.pk) for user_id in likers)
+        self.insert(Like, likes)
+
+    # Return up to count distinct users, favouring the top of the ranking.
+    # Popular users are drawn repeatedly, so draw until enough distinct
+    # users are found or the attempts run out
+    def pick_users(self, ranking, count, exclude=None):
+        users = set()
+        for _ in range(4):
+            users.update(self.rng.choices(
+                ranking, cum_weights=self.user_weights,
+                k=count - len(users)))
+            users.discard(exclude)
+            if len(users) >= count:
+                break
+        return users
+
+    def insert(self, model, rows):
+        model.objects.bulk_create(
+            rows, batch_size=self.batch_size, ignore_conflicts=True)
+        return len(rows)
+
+
+# Words for generated post content, so the search index has terms of
+# varying frequency
+WORDS = [
+    "music", "guitar", "piano", "drums", "film", "travel", "cooking",
+    "coffee", "football", "chess", "python", "django", "photography",
+    "gardening", "history", "science", "poetry", "running", "cycling",
+    "painting", "astronomy", "birds", "jazz", "opera", "hiking",
+]
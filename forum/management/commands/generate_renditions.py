@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from forum import images
+from forum.models import Post, Board
+
+
+# Generates the resized renditions of every post, comment and board
+# image that does not have them yet, for example images uploaded
+# before renditions existed
+class Command(BaseCommand):
+    help = "Generate resized renditions of images that lack them."
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in (Board, Post):
+            objects = model.objects.exclude(thumb="") \
+                .only("id", "thumb", "thumb_meta")
+            for instance in objects.iterator():
+                if images.needs_renditions(instance):
+                    images.generate_renditions(
+                        instance._meta.label, instance.pk)
+                    total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated renditions for {total} images."))
@@ -0,0 +1,205 @@
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from forum.models import User, Post, Board
+
+
+# Load tests the JSON API and a board page under each serving mode.
+# For every mode the command starts Gunicorn with config/gunicorn.conf.py
+# on a free local port, sends requests from --concurrency client threads
+# for --duration seconds per endpoint, and reports requests per second
+# and latency percentiles as JSON. Pass --url to load test a server that
+# is already running instead.
+#
+# The server uses the configured database, which should hold a
+# realistic amount of data (see "benchmark_indexes --seed"). Only read
+# requests are sent. A "loadtest" user is created to sign in with.
+class Command(BaseCommand):
+    help = "Compare requests per second and latency of the WSGI and " \
+           "ASGI serving modes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--modes",
+            nargs="+",
+            choices=["wsgi", "asgi"],
+            default=["wsgi", "asgi"],
+            help="Serving modes to compare.")
+        parser.add_argument(
+            "--url",
+            help="Load test the server running at this URL instead of "
+                 "starting one per mode.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of Gunicorn worker processes.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Number of concurrent client connections.")
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="Seconds to load each endpoint.")
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        paths = endpoints()
+        cookie = session_cookie()
+
+        def run(url):
+            return {
+                name: load(url + path, cookie if signed_in else None,
+                           options["concurrency"], options["duration"])
+                for name, (path, signed_in) in paths.items()
+            }
+
+        report = {
+            "concurrency": options["concurrency"],
+            "duration": options["duration"],
+        }
+        if options["url"]:
+            report["results"] = {"server": run(options["url"].rstrip("/"))}
+        else:
+            report["workers"] = options["workers"]
+            report["results"] = {}
+            for mode in options["modes"]:
+                with serve(mode, options["workers"]) as url:
+                    report["results"][mode] = run(url)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+
+# Return the paths to load test and whether each needs a signed-in user
+def endpoints():
+    board = Board.objects.order_by("id").first()
+    post = Post.objects.filter(parent=None).order_by("id").first()
+    if board is None or post is None:
+        raise CommandError(
+            "No posts to load test. Use benchmark_indexes --seed.")
+    ids = ",".join(str(pk) for pk in Post.objects.order_by("-id")
+                   .values_list("id", flat=True)[:20])
+    return {
+        "board_feed": (f"/forum/boards/{board.id}/posts", False),
+        "post": (f"/forum/{post.id}", True),
+        "like_states": (f"/forum/posts/likes?ids={ids}", True),
+        "board_page": (f"/board/{board.id}", False),
+    }
+
+
+# Sign in the load test user and return its session cookie
+def session_cookie(username="loadtest"):
+    user, _ = User.objects.get_or_create(username=username)
+    client = Client()
+    client.force_login(user)
+    return {settings.SESSION_COOKIE_NAME:
+            client.cookies[settings.SESSION_COOKIE_NAME].value}
+
+
+# Run Gunicorn in the given mode, with any extra environment variables,
+# for the duration of the block and yield its base URL
+@contextmanager
+def serve(mode, workers, env=None):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {
+        **os.environ,
+        "FORUM_SERVER_MODE": mode,
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "GUNICORN_ACCESS_LOG": "",
+        "WEB_CONCURRENCY": str(workers),
+        **(env or {}),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn",
+         "-c", os.path.join("config", "gunicorn.conf.py")],
+        cwd=settings.BASE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(url + "/", timeout=5)
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise CommandError(
+                        f"Gunicorn did not start in {mode} mode.")
+                time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+# Send requests to a URL from concurrent threads for the given number of
+# seconds and summarize the latencies of the successful ones
+def load(url, cookies, concurrency, duration):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        if cookies:
+            session.cookies.update(cookies)
+        own = []
+        failed = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                own.append((time.perf_counter() - start) * 1000)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(own)
+            errors += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+# Nearest-rank percentile of a sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from forum.models import User, Post, Board
+
+Follow = User.following.through
+
+
+# Return the number of rows of a queryset that match the outer row,
+# for use in an UPDATE
+def count(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(total=Count("*"))
+        .values("total"), output_field=IntegerField()), 0)
+
+
+# Recomputes the denormalized counters: like_count and comment_count
+# on Post from the likes table and the comment rows, follower_count and
+# following_count on User from the follows table, then the statistics
+# stored on each Board. Posts and users are updated in primary key
+# ranges so large tables are not locked by one long-running statement
+class Command(BaseCommand):
+    help = "Rebuild the counters on every post, user and board."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of posts or users to update per statement.")
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        posts = self.rebuild(
+            Post,
+            like_count=count(User.likes.through.objects, "post"),
+            comment_count=count(Post.objects, "parent"))
+        users = self.rebuild(
+            User,
+            follower_count=count(Follow.objects, "to_user"),
+            following_count=count(Follow.objects, "from_user"))
+
+        # Boards are few, and each board's subqueries read only its own
+        # posts through the board index
+        latest = Post.objects.filter(board=OuterRef("pk")).order_by("-id")
+        with transaction.atomic():
+            boards = Board.objects.update(
+                post_count=count(Post.objects.filter(parent=None), "board"),
+                comment_count=count(
+                    Post.objects.filter(parent__isnull=False), "board"),
+                last_post=Subquery(latest.values("pk")[:1]),
+                last_post_at=Subquery(latest.values("timestamp")[:1]))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt counters for {posts} posts, {users} users and "
+            f"{boards} boards."))
+
+    # Update every row of a model with the given expressions, walking
+    # the table in primary key ranges
+    def rebuild(self, model, **expressions):
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:self.batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += model.objects \
+                    .filter(pk__gte=ids[0], pk__lte=ids[-1]) \
+                    .update(**expressions)
+            last_id = ids[-1]
+        return updated
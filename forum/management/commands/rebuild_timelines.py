@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from forum import timeline
+from forum.models import User
+
+
+# Rebuilds every user's Following page timeline from the accounts they
+# follow. Use it after changing FORUM_TIMELINE_FANOUT_LIMIT or
+# FORUM_TIMELINE_MAX_ENTRIES, or if timelines are missing entries
+class Command(BaseCommand):
+    help = "Rebuild the Following page timeline of every user."
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(following__isnull=False).distinct()
+        total = 0
+        for user in users.iterator():
+            timeline.rebuild(user)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt timelines for {total} users."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from forum import search
+
+
+# Rebuilds the full-text search index from the posts table. The index
+# is updated whenever a post is saved, so this is only needed after
+# bulk imports, manual database edits or a change of tokenizer
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of post content."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of posts to index per batch.")
+
+    def handle(self, *args, **options):
+        total = search.rebuild(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reindexed {total} posts."))
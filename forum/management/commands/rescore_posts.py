@@ -0,0 +1,75 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from forum import ranking
+from forum.models import Post
+from forum.signals import invalidate
+
+
+# Recomputes the hot and trending scores of top-level posts (see
+# forum/ranking.py). Scores are refreshed whenever a post is liked or
+# commented on, but the trending score also decays as posts age, so
+# run this every few minutes. It rescores the posts of the last --days
+# days and drops older posts out of trending. Pass --all to rescore
+# every post, e.g. after bulk imports or a change to the formulas. The
+# cached pages of the affected boards are invalidated, since their hot
+# and trending orders may have changed
+class Command(BaseCommand):
+    help = "Recompute the hot and trending scores of posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=7,
+            help="Rescore the posts of this many recent days.")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Rescore every post.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of posts to update per statement.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        posts = Post.objects.filter(parent=None)
+        dropped = 0
+        board_ids = set()
+        if not options["all"]:
+            cutoff = now - timedelta(days=options["days"])
+            stale = posts.filter(timestamp__lt=cutoff, trending_score__gt=0)
+            board_ids.update(
+                stale.values_list("board_id", flat=True).distinct())
+            dropped = stale.update(trending_score=0)
+            posts = posts.filter(timestamp__gte=cutoff)
+
+        # Walk the posts in primary key ranges
+        rescored = 0
+        last_id = 0
+        while True:
+            rows = list(
+                posts.filter(pk__gt=last_id).order_by("pk").values_list(
+                    "pk", "board_id", "like_count", "comment_count",
+                    "timestamp")
+                [:options["batch_size"]])
+            if not rows:
+                break
+            batch = [
+                Post(pk=pk, **ranking.scores(
+                    like_count, comment_count, timestamp, now))
+                for pk, _, like_count, comment_count, timestamp in rows
+            ]
+            board_ids.update(row[1] for row in rows)
+            with transaction.atomic():
+                Post.objects.bulk_update(
+                    batch, ["hot_score", "trending_score"])
+            rescored += len(batch)
+            last_id = rows[-1][0]
+        invalidate([f"board:{board_id}" for board_id in sorted(board_ids)])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescored {rescored} posts, dropped {dropped} from trending."))
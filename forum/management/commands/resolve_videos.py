@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from forum import embeds
+from forum.models import Post
+
+
+# Resolves the embed metadata of every post and comment video link that
+# does not have it yet, for example links posted before metadata
+# existed or whose provider lookup failed
+class Command(BaseCommand):
+    help = "Resolve the embed metadata of video links that lack it."
+
+    def handle(self, *args, **options):
+        total = 0
+        posts = Post.objects.exclude(video="") \
+            .only("id", "video", "video_meta")
+        for post in posts.iterator():
+            if embeds.needs_metadata(post) or \
+                    "embed_url" not in post.video_meta:
+                Post.objects.filter(pk=post.pk).update(video_meta={})
+                embeds.resolve_video(post.pk)
+                total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Resolved {total} video links."))
@@ -0,0 +1,194 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.crypto import get_random_string
+from forum.models import Board, Post
+from .loadtest import percentile, serve, session_cookie
+
+
+# Stress tests concurrent writes. The command starts Gunicorn on the
+# configured database (with the SQLite production profile of
+# FORUM_SQLITE_TUNING unless --no-tuning is passed) and sends likes,
+# unlikes, comments and new posts from --concurrency signed-in clients
+# at a combined --rate writes per second for --duration seconds. It
+# reports the achieved write rate, latency percentiles and failed
+# requests by status code as JSON, and exits with an error if any write
+# failed. A locked database surfaces as a 500 response. Pass --url to
+# stress a server that is already running instead.
+#
+# Writes go to the busiest posts of the first board, so clients contend
+# for the same rows. Only run it against a throwaway database.
+class Command(BaseCommand):
+    help = "Send concurrent writes to the server and report lock errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Stress the server running at this URL instead of "
+                 "starting one.")
+        parser.add_argument(
+            "--mode",
+            choices=["wsgi", "asgi"],
+            default="wsgi",
+            help="Serving mode of the server to start.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of Gunicorn worker processes.")
+        parser.add_argument(
+            "--tuning",
+            action=argparse.BooleanOptionalAction,
+            default=True,
+            help="Start the server with the SQLite production profile "
+                 "and serialized writes.")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Number of concurrent clients.")
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=100.0,
+            help="Target writes per second across all clients.")
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="Seconds to send writes for.")
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        board = Board.objects.order_by("id").first()
+        post_ids = list(
+            Post.objects.filter(board=board, parent=None)
+            .order_by("-like_count").values_list("id", flat=True)[:50])
+        if not post_ids:
+            raise CommandError(
+                "No posts to write to. Use generate_dataset first.")
+        cookies = [
+            session_cookie(f"stress{number}")
+            for number in range(options["concurrency"])
+        ]
+
+        def run(url):
+            return stress(
+                url, board.id, post_ids, cookies, options["rate"],
+                options["duration"])
+
+        report = {
+            "concurrency": options["concurrency"],
+            "rate": options["rate"],
+            "duration": options["duration"],
+        }
+        if options["url"]:
+            report["results"] = run(options["url"].rstrip("/"))
+        else:
+            env = {
+                "FORUM_SQLITE_TUNING": "1" if options["tuning"] else "0",
+                "FORUM_SERIALIZE_WRITES": "1" if options["tuning"] else "0",
+            }
+            report.update({
+                "mode": options["mode"],
+                "workers": options["workers"],
+                "tuning": options["tuning"],
+            })
+            with serve(options["mode"], options["workers"], env) as url:
+                report["results"] = run(url)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+        if report["results"]["errors"]:
+            raise CommandError(
+                f"{report['results']['errors']} writes failed.")
+
+
+# Send one random write as the client's user and return the response
+# status: a like or unlike (70%), a comment (20%) or a new post (10%)
+def write(session, url, board_id, post_ids):
+    post_id = random.choice(post_ids)
+    content = get_random_string(40)
+    choice = random.random()
+    if choice < 0.7:
+        method = "POST" if random.random() < 0.5 else "DELETE"
+        response = session.request(
+            method, f"{url}/forum/{post_id}/like", timeout=30)
+    elif choice < 0.9:
+        response = session.post(
+            f"{url}/forum/comment/compose/{post_id}",
+            data={"content": content}, timeout=30)
+    else:
+        response = session.post(
+            f"{url}/board/{board_id}", data={"content": content},
+            allow_redirects=False, timeout=30)
+    return response.status_code
+
+
+# Send writes from one thread per session cookie, each paced to its
+# share of the target rate, and summarize the results
+def stress(url, board_id, post_ids, cookies, rate, duration):
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    interval = len(cookies) / rate
+    started = time.monotonic()
+    deadline = started + duration
+
+    def worker(cookie):
+        session = requests.Session()
+        csrf_token = get_random_string(32)
+        session.cookies.update(
+            {**cookie, settings.CSRF_COOKIE_NAME: csrf_token})
+        session.headers.update({"X-CSRFToken": csrf_token})
+        own = []
+        own_statuses = Counter()
+        next_write = time.monotonic() + random.uniform(0, interval)
+        while next_write < deadline:
+            time.sleep(max(0.0, next_write - time.monotonic()))
+            start = time.perf_counter()
+            try:
+                status = write(session, url, board_id, post_ids)
+            except requests.RequestException:
+                status = 0
+            own.append((time.perf_counter() - start) * 1000)
+            own_statuses[status] += 1
+            next_write += interval
+        with lock:
+            latencies.extend(own)
+            statuses.update(own_statuses)
+
+    threads = [
+        threading.Thread(target=worker, args=(cookie,))
+        for cookie in cookies
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    errors = {
+        str(status): count for status, count in statuses.items()
+        if not 200 <= status < 400
+    }
+    return {
+        "writes": len(latencies),
+        "writes_per_second": round(len(latencies) / elapsed, 1),
+        "errors": sum(errors.values()),
+        "errors_by_status": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
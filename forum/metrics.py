@@ -0,0 +1,86 @@
+import os
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess)
+
+# Prometheus metrics, served at /metrics. Request latency and query
+# counts are recorded by InstrumentationMiddleware for every request,
+# labelled with the URL name from forum/urls.py. Cache, upload and
+# activity counters are recorded where those things happen.
+#
+# Under Gunicorn each worker process keeps its own metrics.
+# config/gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR, where every
+# worker writes its values to files, and /metrics adds up the files of
+# all workers, so a scrape sees the whole server whichever worker
+# answers it. Only counters and histograms are used, since both add up
+# across processes.
+
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+REQUEST_DURATION = Histogram(
+    "forum_request_duration_seconds",
+    "Time taken to respond to a request.",
+    ["view", "method", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    "forum_request_queries",
+    "Number of SQL queries run by a request.",
+    ["view"],
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16, 24, 32, 64, 128))
+CACHE_REQUESTS = Counter(
+    "forum_cache_requests_total",
+    "Page cache lookups, by result (hit or miss).",
+    ["kind", "result"])
+UPLOAD_SIZE = Histogram(
+    "forum_upload_size_bytes",
+    "Size of uploaded images, by upload flow (form or direct).",
+    ["flow"],
+    buckets=(16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6))
+UPLOAD_DURATION = Histogram(
+    "forum_upload_duration_seconds",
+    "Time taken to verify and store an uploaded image, by upload flow.",
+    ["flow"])
+UPLOADS_DEDUPLICATED = Counter(
+    "forum_uploads_deduplicated_total",
+    "Uploads that reused an identical stored image, by upload flow.",
+    ["flow"])
+POSTS_CREATED = Counter(
+    "forum_posts_created_total",
+    "Posts and comments created.",
+    ["kind"])
+LIKES = Counter(
+    "forum_likes_total",
+    "Likes added and removed.",
+    ["action"])
+FOLLOWS = Counter(
+    "forum_follows_total",
+    "Follows and unfollows from profile pages.",
+    ["action"])
+LIVE_STREAMS = Counter(
+    "forum_live_streams_total",
+    "Live event streams opened by board and thread pages.")
+LIVE_EVENTS = Counter(
+    "forum_live_events_total",
+    "Live events published, by type (post, comment, likes).",
+    ["type"])
+
+
+# Record a finished request. Unknown methods are grouped as "other"
+# and status codes by class (2xx, 4xx) to keep the number of series
+# small
+def observe_request(view, method, status, duration, queries):
+    view = view or "unresolved"
+    method = method if method in METHODS else "other"
+    REQUEST_DURATION.labels(view, method, f"{status // 100}xx") \
+        .observe(duration)
+    REQUEST_QUERIES.labels(view).observe(queries)
+
+
+# Return the metrics of this process, or of every worker process in
+# multiprocess mode, in the Prometheus text format
+def render():
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
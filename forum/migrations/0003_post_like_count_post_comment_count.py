@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:31
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Fill the new counters for posts that already exist
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    User = apps.get_model('forum', 'User')
+    likes = User.likes.through.objects.filter(post=OuterRef('pk')) \
+        .order_by().values('post').annotate(total=Count('*')).values('total')
+    comments = Post.objects.filter(parent=OuterRef('pk')) \
+        .order_by().values('parent').annotate(total=Count('*')).values('total')
+    Post.objects.update(
+        like_count=Coalesce(Subquery(likes, output_field=IntegerField()), 0),
+        comment_count=Coalesce(Subquery(comments, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0002_remove_post_image_link_board_thumb_post_thumb_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['board', 'like_count', 'id'], name='post_board_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['board', 'comment_count', 'id'], name='post_board_comments_idx'),
+        ),
+    ]
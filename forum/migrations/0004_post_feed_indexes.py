@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0003_post_like_count_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='child_posts', to='forum.post'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['board', '-timestamp', '-id'], name='post_board_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['author', '-timestamp', '-id'], name='post_author_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent__isnull', False)), fields=['parent', '-timestamp', '-id'], name='post_parent_time_idx'),
+        ),
+    ]
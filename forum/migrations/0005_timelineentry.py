@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Build the timelines of existing users from the accounts they follow
+def populate_timelines(apps, schema_editor):
+    User = apps.get_model('forum', 'User')
+    Post = apps.get_model('forum', 'Post')
+    TimelineEntry = apps.get_model('forum', 'TimelineEntry')
+    limit = settings.FORUM_TIMELINE_MAX_ENTRIES
+    for user in User.objects.filter(following__isnull=False).distinct():
+        posts = Post.objects.filter(
+            parent=None, author__in=user.following.all()) \
+            .order_by('-timestamp', '-id') \
+            .values_list('id', 'timestamp')[:limit]
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user=user, post_id=post_id, timestamp=timestamp)
+                for post_id, timestamp in posts
+            ],
+            batch_size=1000,
+            ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0004_post_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='forum.post')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-timestamp', '-post'], name='timeline_user_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'post'), name='timeline_user_post_unique')],
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0005_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='thumb_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thumb_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
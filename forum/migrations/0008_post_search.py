@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+import django.db.models.deletion
+import forum.models
+from django.db import migrations, models
+
+
+# Create the full-text index of post content. SQLite gets an FTS5 table
+# filled from the existing posts. PostgreSQL gets a GIN index on the
+# same tsvector expression that forum/search.py queries
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE forum_post_fts USING fts5("
+            "content, tokenize='porter unicode61')")
+        schema_editor.execute(
+            'INSERT INTO forum_post_fts (rowid, content) '
+            'SELECT id, content FROM forum_post')
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+        schema_editor.add_index(
+            apps.get_model('forum', 'Post'),
+            GinIndex(
+                SearchVector('content', config='english'),
+                name='post_search_idx'))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE forum_post_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX post_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0007_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearchEntry',
+            fields=[
+                ('post', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='forum.post')),
+                ('content', forum.models.SearchContentField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'forum_post_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
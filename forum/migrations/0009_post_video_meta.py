@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0008_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='video_meta',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:44
+
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+# Fill in the paths of posts that already exist, one thread level at a
+# time: top-level posts first, then the replies whose parent has a path
+def populate_paths(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    segment = LPad(Cast('id', CharField()), 10, Value('0'))
+    Post.objects.filter(parent=None).update(path=segment)
+    parent_path = Post.objects.filter(pk=OuterRef('parent_id')).values('path')
+    while Post.objects.filter(path='').exclude(parent__path='').update(
+            path=Concat(Subquery(parent_path), segment,
+                        output_field=CharField())):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0009_post_video_meta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=250),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['path'], name='post_path_idx'),
+        ),
+    ]
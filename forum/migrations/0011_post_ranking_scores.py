@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:49
+
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# The ranking formulas of forum/ranking.py as of this migration, copied
+# so that later changes to that module do not change what it does
+def scores(like_count, comment_count, timestamp, now):
+    engagement = like_count + 2 * comment_count
+    epoch = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+    hours = max((now - timestamp).total_seconds() / 3600, 0)
+    return {
+        'hot_score': math.log10(max(engagement, 1)) +
+        (timestamp - epoch).total_seconds() / 45000,
+        'trending_score': engagement / (hours + 2) ** 1.5,
+    }
+
+
+# Score the top-level posts that already exist
+def populate_scores(apps, schema_editor):
+    Post = apps.get_model('forum', 'Post')
+    now = timezone.now()
+    posts = Post.objects.filter(parent=None).only(
+        'id', 'like_count', 'comment_count', 'timestamp')
+    batch = []
+    for post in posts.iterator(chunk_size=2000):
+        for name, value in scores(
+                post.like_count, post.comment_count, post.timestamp,
+                now).items():
+            setattr(post, name, value)
+        batch.append(post)
+        if len(batch) == 2000:
+            Post.objects.bulk_update(batch, ['hot_score', 'trending_score'])
+            batch = []
+    Post.objects.bulk_update(batch, ['hot_score', 'trending_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0010_post_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(populate_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['board', 'hot_score', 'id'], name='post_board_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent', None)), fields=['board', 'trending_score', 'id'], name='post_board_trending_idx'),
+        ),
+    ]
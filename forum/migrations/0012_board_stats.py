@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Compute the statistics of the boards that already exist
+def populate_stats(apps, schema_editor):
+    Board = apps.get_model('forum', 'Board')
+    Post = apps.get_model('forum', 'Post')
+
+    def count(**filters):
+        return Coalesce(Subquery(
+            Post.objects.filter(board=OuterRef('pk'), **filters)
+            .order_by().values('board').annotate(total=Count('*'))
+            .values('total'), output_field=IntegerField()), 0)
+
+    latest = Post.objects.filter(board=OuterRef('pk')).order_by('-id')
+    Board.objects.update(
+        post_count=count(parent=None),
+        comment_count=count(parent__isnull=False),
+        last_post=Subquery(latest.values('pk')[:1]),
+        last_post_at=Subquery(latest.values('timestamp')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_post_ranking_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='last_post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.post'),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='last_post_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:02
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Indexes on the auto-created follows table, which cannot declare them
+# in Meta. They serve the follower and following lists, which seek
+# through one user's follows in ID order. SQLite indexes end with the
+# row ID, so there the foreign key indexes already serve that order
+FOLLOW_INDEXES = [
+    models.Index(fields=['to_user', 'id'], name='follow_to_user_idx'),
+    models.Index(fields=['from_user', 'id'], name='follow_from_user_idx'),
+]
+
+
+# Count the follows that already exist
+def populate_counts(apps, schema_editor):
+    User = apps.get_model('forum', 'User')
+    Follow = User.following.through
+
+    def count(field):
+        return Coalesce(Subquery(
+            Follow.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field).annotate(total=Count('*'))
+            .values('total'), output_field=IntegerField()), 0)
+
+    User.objects.update(
+        follower_count=count('to_user'),
+        following_count=count('from_user'))
+
+
+def create_follow_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        return
+    Follow = apps.get_model('forum', 'User').following.through
+    for index in FOLLOW_INDEXES:
+        schema_editor.add_index(Follow, index)
+
+
+def drop_follow_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        return
+    Follow = apps.get_model('forum', 'User').following.through
+    for index in FOLLOW_INDEXES:
+        schema_editor.remove_index(Follow, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_board_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+        migrations.RunPython(create_follow_indexes, drop_follow_indexes),
+    ]
@@ -1,6 +1,18 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Length
+from django.utils import timezone
 from embed_video.fields import EmbedVideoField
+from . import metrics, ranking, writer
+
+# Usernames that cannot be registered because a fixed route uses the
+# same path segment as the profile page (/<username>) or the user API
+# route (/forum/<username>), which would never be reached
+RESERVED_USERNAMES = frozenset((
+    "following", "login", "logout", "metrics", "register", "search",
+    "uploads"))
 
 
 # Create a User model with fields for the users the user
@@ -16,19 +28,187 @@ class User(AbstractUser):
         blank=True,
         related_name="like_users")
 
+    # Number of users following the user and followed by the user, kept
+    # up to date by follow() and unfollow() so profiles do not count the
+    # follows table. "manage.py rebuild_counters" recomputes them
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
     # Translate the User model into JSON format
     def serialize(self):
         return {
             "username": self.username,
+            "follower_count": self.follower_count,
+            "following_count": self.following_count,
             "following": [user.username for user in self.following.all()],
-            "likes": [post.serialize() for post in self.likes.all()]
+            "likes": [
+                post.serialize()
+                for post in self.likes.select_related("author", "board")
+            ]
         }
 
+    # Record that the user likes a post and increment the post's like
+    # counter. Liking a post twice has no effect. Returns True if a new
+    # like was recorded
+    def like(self, post_id):
+        with transaction.atomic():
+            _, created = User.likes.through.objects.get_or_create(
+                user_id=self.pk, post_id=post_id)
+            if created:
+                Post.objects.filter(pk=post_id) \
+                    .update(like_count=F("like_count") + 1)
+                Post.objects.filter(pk=post_id).refresh_scores()
+                self.like_changed(post_id, "like")
+        return created
+
+    # Remove the user's like from a post and decrement the post's like
+    # counter. Returns True if a like was removed
+    def unlike(self, post_id):
+        with transaction.atomic():
+            deleted, _ = User.likes.through.objects \
+                .filter(user_id=self.pk, post_id=post_id).delete()
+            if deleted:
+                Post.objects.filter(pk=post_id, like_count__gt=0) \
+                    .update(like_count=F("like_count") - 1)
+                Post.objects.filter(pk=post_id).refresh_scores()
+                self.like_changed(post_id, "unlike")
+        return bool(deleted)
+
+    # Count a like or unlike, invalidate the cached pages that show the
+    # post's like count and push the new count to live streams. Rows of
+    # the auto-created likes table send no model signals, so this cannot
+    # be a signal receiver
+    def like_changed(self, post_id, action):
+        from . import events
+        from .signals import invalidate, post_namespaces
+        metrics.LIKES.labels(action).inc()
+        invalidate(post_namespaces(post_id))
+        events.likes_changed([post_id])
+
+    # Remove the user's like from a post, or like it if the user had
+    # not. Removing the like doubles as the membership test, so the
+    # user's likes are never loaded. Returns True if the post is now liked
+    def toggle_like(self, post_id):
+        return not self.unlike(post_id) and self.like(post_id)
+
+    # Record that the user follows another user and increment both
+    # users' counters. Following a user twice has no effect. Returns
+    # True if a new follow was recorded
+    def follow(self, user):
+        with transaction.atomic():
+            _, created = User.following.through.objects.get_or_create(
+                from_user_id=self.pk, to_user_id=user.pk)
+            if created:
+                User.objects.filter(pk=self.pk) \
+                    .update(following_count=F("following_count") + 1)
+                User.objects.filter(pk=user.pk) \
+                    .update(follower_count=F("follower_count") + 1)
+                self.follow_changed(user, "follow")
+        return created
+
+    # Stop following another user and decrement both users' counters.
+    # Returns True if a follow was removed
+    def unfollow(self, user):
+        with transaction.atomic():
+            deleted, _ = User.following.through.objects \
+                .filter(from_user_id=self.pk, to_user_id=user.pk).delete()
+            if deleted:
+                User.objects.filter(pk=self.pk, following_count__gt=0) \
+                    .update(following_count=F("following_count") - 1)
+                User.objects.filter(pk=user.pk, follower_count__gt=0) \
+                    .update(follower_count=F("follower_count") - 1)
+                self.follow_changed(user, "unfollow")
+        return bool(deleted)
+
+    # Count a follow or unfollow and invalidate both users' profiles,
+    # which show their follower and following counts
+    def follow_changed(self, user, action):
+        from .signals import invalidate
+        metrics.FOLLOWS.labels(action).inc()
+        invalidate([f"user:{self.username}", f"user:{user.username}"])
+
+    # Async versions of like() and unlike() for async views. The
+    # transaction runs in a worker thread (the writer thread when writes
+    # are serialized), as the async ORM does not support transactions
+    async def alike(self, post_id):
+        return await writer.awrite(self.like, post_id)
+
+    async def aunlike(self, post_id):
+        return await writer.awrite(self.unlike, post_id)
+
+    # Reject reserved usernames, e.g. when users are added in the admin
+    def clean(self):
+        super().clean()
+        if self.username.lower() in RESERVED_USERNAMES:
+            raise ValidationError({"username": "This username is reserved."})
+
     # Give the User model a readable name including its username
     def __str__(self):
         return f"{self.username}"
 
 
+# Custom queryset for posts, available as Post.objects and on related
+# managers such as board.posts
+class PostQuerySet(models.QuerySet):
+
+    # Annotate each post with viewer_liked, which is True if the given
+    # user likes the post. Uses one EXISTS subquery against the likes
+    # table, so the cost does not depend on the viewer's like history
+    def with_viewer_liked(self, user):
+        if not user.is_authenticated:
+            return self.annotate(viewer_liked=Value(False))
+        return self.annotate(viewer_liked=Exists(
+            User.likes.through.objects.filter(
+                user_id=user.pk, post_id=OuterRef("pk"))))
+
+    # Every feed (boards, profiles, following, comments) is built from
+    # this queryset. It joins the author and board rendered on each
+    # card and flags the viewer's likes. Like and comment counts are
+    # read from the denormalized columns, so rendering a page costs
+    # the same number of queries however many posts it shows
+    def for_feed(self, user):
+        return self.select_related("author", "board") \
+            .with_viewer_liked(user)
+
+    # Replies at any depth below the given posts, at most depth levels
+    # down when depth is given, in path order. Each subtree is a range
+    # of the path index, so a whole thread loads in one query
+    def descendants(self, posts, depth=None):
+        condition = Q()
+        for post in posts:
+            subtree = Q(path__gt=post.path, path__lt=path_successor(post.path))
+            if depth is not None:
+                subtree &= Q(path_length__lte=len(post.path) +
+                             depth * PATH_SEGMENT_WIDTH)
+            condition |= subtree
+        if not condition:
+            return self.none()
+        return self.alias(path_length=Length("path")) \
+            .filter(condition).order_by("path")
+
+    # Recompute the ranking scores (see forum/ranking.py) of the
+    # top-level posts in the queryset from their current counters, in a
+    # single update. Callers invalidate the cached pages of the boards
+    # whose order may change
+    def refresh_scores(self):
+        return self.filter(parent=None).update(
+            **ranking.score_expressions(timezone.now()))
+
+
+# Width of each post ID in a materialized path
+PATH_SEGMENT_WIDTH = 10
+
+
+def path_segment(post_id):
+    return f"{post_id:0{PATH_SEGMENT_WIDTH}d}"
+
+
+# The smallest path after every path that starts with the given one.
+# Paths are all digits, so this is the path plus one
+def path_successor(path):
+    return f"{int(path) + 1:0{len(path)}d}"
+
+
 # Create a Post model with fields for a Post's author, board,
 # content, and other properties. The Post model is also used for
 # Comments. The parent field identifies a comment's parent post. 
@@ -47,18 +227,127 @@ class Post(models.Model):
         on_delete=models.CASCADE,
         null=True,
         blank=True,
+        db_index=False,
         related_name='child_posts')
     content = models.CharField(max_length=1000)
     thumb = models.ImageField(blank=True)
     video = EmbedVideoField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    # Dimensions and resized renditions of thumb, filled in by a
+    # background task (see forum/images.py)
+    thumb_meta = models.JSONField(default=dict, blank=True)
+
+    # Provider, embed URL, thumbnail and title of video, filled in by a
+    # background task (see forum/embeds.py)
+    video_meta = models.JSONField(default=dict, blank=True)
+
+    # Denormalized counters so feeds can render and sort posts without
+    # counting likes and comments per row. Kept up to date with F()
+    # expressions by the views and signals; rebuild them with
+    # "manage.py rebuild_counters" if they ever drift
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # Ranking scores of top-level posts for the "hot" and "trending"
+    # board sorts, kept up to date with the counters (see
+    # forum/ranking.py)
+    hot_score = models.FloatField(default=0)
+    trending_score = models.FloatField(default=0)
+
+    # Materialized path of the post in its thread: the zero-padded IDs
+    # of the top-level post, of each ancestor and of the post itself.
+    # Sorting a thread by path lists it depth first with replies oldest
+    # first, and the subtree of a post is the range of paths that start
+    # with its own. Set when the post is first saved
+    path = models.CharField(max_length=250, default="", editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    # Replies nest at most this deep below their top-level post (the
+    # length of path allows one more level)
+    MAX_DEPTH = 24
+
+    # Indexes matched to the feed queries. Board and profile feeds read
+    # top-level posts (parent IS NULL) of one board or author newest
+    # first, comment threads read the children of one post, and the
+    # popularity sorts order a board's top-level posts by a counter.
+    # Each index ends with the ID used as the cursor tiebreaker. The
+    # thread index only covers comments and replaces the default index
+    # on parent: planners (SQLite's in particular) otherwise read
+    # "parent IS NULL" through that index as if it were selective and
+    # never pick the board and author indexes
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["board", "-timestamp", "-id"],
+                condition=Q(parent=None),
+                name="post_board_time_idx"),
+            models.Index(
+                fields=["author", "-timestamp", "-id"],
+                condition=Q(parent=None),
+                name="post_author_time_idx"),
+            models.Index(
+                fields=["parent", "-timestamp", "-id"],
+                condition=Q(parent__isnull=False),
+                name="post_parent_time_idx"),
+            models.Index(
+                fields=["board", "like_count", "id"],
+                condition=Q(parent=None),
+                name="post_board_likes_idx"),
+            models.Index(
+                fields=["board", "comment_count", "id"],
+                condition=Q(parent=None),
+                name="post_board_comments_idx"),
+            models.Index(
+                fields=["board", "hot_score", "id"],
+                condition=Q(parent=None),
+                name="post_board_hot_idx"),
+            models.Index(
+                fields=["board", "trending_score", "id"],
+                condition=Q(parent=None),
+                name="post_board_trending_idx"),
+            models.Index(fields=["path"], name="post_path_idx"),
+        ]
+
+    # Save the post, filling in its path and, for top-level posts, its
+    # ranking scores on the first save. The path includes the post's
+    # own ID and the scores its creation time, so they are written
+    # right after the insert, in the same transaction as the update of
+    # the board's statistics
+    def save(self, *args, **kwargs):
+        if self.path:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            fields = {"path": (self.parent.path if self.parent_id else "") +
+                      path_segment(self.pk)}
+            if self.parent_id is None:
+                fields.update(ranking.scores(
+                    self.like_count, self.comment_count, self.timestamp,
+                    timezone.now()))
+            for name, value in fields.items():
+                setattr(self, name, value)
+            Post.objects.filter(pk=self.pk).update(**fields)
+            counter = "post_count" if self.parent_id is None \
+                else "comment_count"
+            Board.objects.filter(pk=self.board_id).update(
+                last_post=self, last_post_at=self.timestamp,
+                **{counter: F(counter) + 1})
+
+    # Depth of the post in its thread: 0 for top-level posts, 1 for
+    # their comments, 2 for replies to those, and so on
+    @property
+    def depth(self):
+        return len(self.path) // PATH_SEGMENT_WIDTH - 1
+
+    # ID of the top-level post of the post's thread
+    @property
+    def root_id(self):
+        return int(self.path[:PATH_SEGMENT_WIDTH])
+
     # Translate the Post model into JSON format
     def serialize(self):
-        if self.parent is not None:
-            parent = self.parent.id
-        else:
-            parent = None
         if self.thumb:
             url = self.thumb.url
         else:
@@ -67,10 +356,12 @@ class Post(models.Model):
             "id": self.id,
             "author": self.author.username,
             "board": self.board.name,
-            "parent": parent,
+            "parent": self.parent_id,
             "content": self.content,
             "thumb": url,
             "video": self.video,
+            "like_count": self.like_count,
+            "comment_count": self.comment_count,
             "timestamp": self.timestamp.strftime("%b %-d %Y, %-I:%M %p")
         }
 
@@ -86,6 +377,112 @@ class Board(models.Model):
     thumb = models.ImageField(blank=True)
     description = models.CharField(max_length=8000, blank=True)
 
+    # Dimensions and resized renditions of thumb, filled in by a
+    # background task (see forum/images.py)
+    thumb_meta = models.JSONField(default=dict, blank=True)
+
+    # Statistics shown on the index page: the number of top-level posts
+    # and comments and the latest of either. They are kept up to date
+    # when posts are created (Post.save) and deleted (forum/signals.py)
+    # so the index page never aggregates the posts table, and are
+    # recomputed by "manage.py rebuild_counters"
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_post_at = models.DateTimeField(null=True, blank=True)
+    last_post = models.ForeignKey(
+        Post,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+")
+
     # Give the Board model a readable name including its name
     def __str__(self):
         return f"{self.name}"
+
+
+# Create a TimelineEntry model that materializes each user's Following
+# page. When a post is created, an entry is written for every follower
+# of its author (fan-out on write), so reading the page is a range scan
+# over the reader's own entries. The post's timestamp is copied onto
+# the entry so the index can serve the ordering
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        related_name="timeline_entries")
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries")
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"],
+                name="timeline_user_post_unique"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-timestamp", "-post"],
+                name="timeline_user_time_idx"),
+        ]
+
+    # Give the TimelineEntry model a readable name
+    def __str__(self):
+        return f"{self.user.username} {self.post_id}"
+
+
+# Create an Upload model that records every image stored through the
+# upload flows under the SHA-256 hash of its content. Uploading an image
+# that is already stored reuses the existing file instead of writing a
+# second copy. Images uploaded directly to storage get a row as soon as
+# the upload is requested; the file exists once the client has sent it
+class Upload(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    # Give the Upload model a readable name including its file name
+    def __str__(self):
+        return f"{self.name}"
+
+
+# Text column of the SQLite full-text index, which supports the match
+# lookup (content__match="...")
+class SearchContentField(models.TextField):
+    pass
+
+
+@SearchContentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+# The full-text index of post content on SQLite: an FTS5 virtual table
+# whose rowid is the post ID, created by a migration and kept up to date
+# by forum/search.py. rank is FTS5's BM25 score of the current match
+# (lower is better). PostgreSQL indexes Post.content directly instead,
+# so this table only exists on SQLite
+class PostSearchEntry(models.Model):
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        related_name="search_entry")
+    content = SearchContentField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "forum_post_fts"
@@ -0,0 +1,165 @@
+import base64
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+# Keyset (cursor) pagination for feeds. Instead of counting every row
+# and skipping to an OFFSET like Django's Paginator, each page remembers
+# the sort key of its first and last rows in an opaque cursor, and the
+# next page is fetched with a WHERE clause that seeks past that key. The
+# cost of a page is the same whether it is the first or the five
+# hundredth, and no COUNT(*) query is issued.
+#
+# The queryset must be ordered, and its last ordering field must be
+# unique (normally "id" or "-id") so that every row has a distinct key.
+class CursorPaginator:
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+        # Split the queryset's ordering into field names and directions
+        self.ordering = []
+        for field in queryset.query.order_by:
+            if not isinstance(field, str):
+                raise ValueError("Cursor pagination requires field orderings.")
+            self.ordering.append((field.lstrip("-"), field.startswith("-")))
+        if not self.ordering:
+            raise ValueError("Cursor pagination requires an ordered queryset.")
+
+    # Return the page after (or before) the given cursor. A missing or
+    # malformed cursor returns the first page
+    def page(self, cursor=None):
+        queryset, forward, has_other = self.page_queryset(cursor)
+        return self.make_page(list(queryset), forward, has_other)
+
+    # Async version of page() for async views
+    async def apage(self, cursor=None):
+        queryset, forward, has_other = self.page_queryset(cursor)
+        rows = [row async for row in queryset]
+        return self.make_page(rows, forward, has_other)
+
+    # Return the query for the rows of a page, one more than the page
+    # holds to find out whether another page follows, with its
+    # direction and whether a page precedes it
+    def page_queryset(self, cursor):
+        position = self.decode_cursor(cursor)
+        if position is None:
+            values, forward, has_other = None, True, False
+        else:
+            (values, forward), has_other = position, True
+        queryset = self.queryset
+        if not forward:
+            queryset = queryset.reverse()
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, forward))
+        return queryset[:self.per_page + 1], forward, has_other
+
+    def make_page(self, rows, forward, has_other):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if forward:
+            return CursorPage(self, rows, has_next=has_more,
+                              has_previous=has_other)
+        return CursorPage(self, rows, has_next=has_other,
+                          has_previous=has_more)
+
+    # Build the WHERE clause that selects the rows strictly after the
+    # given key in the requested direction. For an ordering (a, b) this
+    # is (a > x) OR (a = x AND b > y), with the comparison flipped for
+    # descending fields and for backward pages
+    def seek(self, values, forward):
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = "lt" if descending == forward else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    # Read the sort key of a row, a model instance or a values() dict
+    def key(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name, _ in self.ordering]
+        return [getattr(row, name) for name, _ in self.ordering]
+
+    def encode_cursor(self, row, forward):
+        values = []
+        for value in self.key(row):
+            if hasattr(value, "isoformat"):
+                value = value.isoformat()
+            values.append(value)
+        data = json.dumps([values, forward], separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            values, forward = json.loads(
+                base64.urlsafe_b64decode(cursor + padding))
+            if len(values) != len(self.ordering):
+                return None
+            values = [
+                self.to_python(name, value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            return None
+        return values, bool(forward)
+
+    # Convert a cursor value back to the type of its model field or
+    # annotation
+    def to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = self.queryset.query.annotations[name].output_field
+        return field.to_python(value)
+
+
+# One page of a CursorPaginator. Iterates like a Paginator page, but
+# exposes next and previous cursors instead of page numbers
+class CursorPage:
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.cursor_paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.cursor_paginator.encode_cursor(
+            self.object_list[-1], forward=True)
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.cursor_paginator.encode_cursor(
+            self.object_list[0], forward=False)
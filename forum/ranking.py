@@ -0,0 +1,82 @@
+import math
+from datetime import datetime, timezone
+from django.db.models import F, FloatField, Func, Value
+from django.db.models.functions import Greatest, Log, Power
+
+# Ranking scores for the "hot" and "trending" board sorts. Both are
+# stored on each top-level post (Post.hot_score and
+# Post.trending_score) and indexed per board, so a sorted board page is
+# an index scan. Engagement counts a comment as two likes.
+#
+# The hot score is the log of the engagement plus the post's creation
+# time in units of 12.5 hours, so a post needs ten times the engagement
+# of one posted 12.5 hours later to rank level with it. It does not
+# change as time passes, only when the post is liked or commented on.
+#
+# The trending score is the engagement divided by a power of the
+# post's age in hours, so posts sink as they age unless they keep
+# drawing likes and comments. It is refreshed when the post is liked or
+# commented on, and decays through "manage.py rescore_posts", which
+# should run every few minutes (from cron, for example). Posts older
+# than its --days window drop out of trending.
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HOT_TIME_SCALE = 45000
+TRENDING_GRAVITY = 1.5
+TRENDING_OFFSET_HOURS = 2
+
+
+def engagement(like_count, comment_count):
+    return like_count + 2 * comment_count
+
+
+def hot_score(like_count, comment_count, timestamp):
+    order = math.log10(max(engagement(like_count, comment_count), 1))
+    return order + (timestamp - EPOCH).total_seconds() / HOT_TIME_SCALE
+
+
+def trending_score(like_count, comment_count, timestamp, now):
+    hours = max((now - timestamp).total_seconds() / 3600, 0)
+    return engagement(like_count, comment_count) / \
+        (hours + TRENDING_OFFSET_HOURS) ** TRENDING_GRAVITY
+
+
+# Return both scores of a post as field values
+def scores(like_count, comment_count, timestamp, now):
+    return {
+        "hot_score": hot_score(like_count, comment_count, timestamp),
+        "trending_score": trending_score(
+            like_count, comment_count, timestamp, now),
+    }
+
+
+# Seconds since 1970 of a datetime column. SQL has no portable way to
+# get them, so each supported database has its own template
+class Epoch(Func):
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="((julianday(%(expressions)s) - 2440587.5) * 86400.0)",
+            **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="EXTRACT(EPOCH FROM %(expressions)s)::double precision",
+            **extra_context)
+
+
+# Return both scores as expressions of a post's own columns, so that
+# an update() can refresh them without reading the posts first
+def score_expressions(now):
+    engagement = F("like_count") + 2 * F("comment_count")
+    created = Epoch("timestamp")
+    hours = Greatest((Value(now.timestamp()) - created) / 3600, Value(0.0))
+    return {
+        "hot_score": Log(10, Greatest(engagement, 1)) +
+        (created - EPOCH.timestamp()) / HOT_TIME_SCALE,
+        "trending_score": engagement /
+        Power(hours + TRENDING_OFFSET_HOURS, TRENDING_GRAVITY),
+    }
@@ -0,0 +1,108 @@
+import re
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Value
+from .models import Post
+
+# Full-text search over post and comment content. Each database uses
+# its own inverted index:
+#
+# - SQLite: the FTS5 table forum_post_fts (PostSearchEntry), updated
+#   from the post_save and post_delete signals whenever a post is
+#   created, edited or deleted.
+# - PostgreSQL: a GIN index on to_tsvector(content), which PostgreSQL
+#   maintains itself.
+#
+# Other databases fall back to an unindexed substring match. Results
+# are annotated with search_rank, where higher is more relevant.
+# "manage.py reindex_search" rebuilds the index in bulk.
+
+SEARCH_CONFIG = "english"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+# Turn search text into an FTS5 query that matches posts containing
+# every word. Words are quoted so that FTS5 operators and punctuation
+# typed by users are not interpreted
+def fts_query(text):
+    return " ".join(f'"{token}"' for token in TOKEN_PATTERN.findall(text))
+
+
+# Filter a queryset of posts to those matching the search text and
+# annotate each with its search_rank
+def search_posts(text, queryset=None):
+    if queryset is None:
+        queryset = Post.objects.all()
+    unranked = Value(0.0, output_field=FloatField())
+    if not TOKEN_PATTERN.search(text):
+        return queryset.none().annotate(search_rank=unranked)
+    if connection.vendor == "sqlite":
+        return queryset \
+            .filter(search_entry__content__match=fts_query(text)) \
+            .annotate(search_rank=-F("search_entry__rank"))
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import (
+            SearchQuery, SearchRank, SearchVector)
+        vector = SearchVector("content", config=SEARCH_CONFIG)
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type="websearch")
+        return queryset.alias(document=vector) \
+            .filter(document=query) \
+            .annotate(search_rank=SearchRank(vector, query))
+    return queryset.filter(content__icontains=text) \
+        .annotate(search_rank=unranked)
+
+
+# Add or update a post in the SQLite index
+def index_post(post_id, content):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM forum_post_fts WHERE rowid = %s", [post_id])
+        cursor.execute(
+            "INSERT INTO forum_post_fts (rowid, content) VALUES (%s, %s)",
+            [post_id, content])
+
+
+# Remove a post from the SQLite index
+def remove_post(post_id):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM forum_post_fts WHERE rowid = %s", [post_id])
+
+
+# Rebuild the whole index, batch_size posts at a time. On SQLite the
+# rebuild is one transaction, so searches keep using the old index
+# until it finishes. Returns the number of posts indexed
+def rebuild(batch_size=5000):
+    total = Post.objects.count()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("REINDEX INDEX post_search_idx")
+        return total
+    if connection.vendor != "sqlite":
+        return 0
+    posts = Post.objects.values_list("id", "content").order_by("id")
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("DELETE FROM forum_post_fts")
+        batch = []
+        for row in posts.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                insert_batch(cursor, batch)
+                batch = []
+        insert_batch(cursor, batch)
+
+        # Merge the index segments written by the batches into one
+        cursor.execute(
+            "INSERT INTO forum_post_fts (forum_post_fts) VALUES ('optimize')")
+    return total
+
+
+def insert_batch(cursor, rows):
+    if rows:
+        cursor.executemany(
+            "INSERT INTO forum_post_fts (rowid, content) VALUES (%s, %s)",
+            rows)
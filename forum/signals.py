@@ -0,0 +1,168 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete)
+from django.dispatch import receiver
+from . import cache, embeds, events, images, metrics, search, tasks
+from .models import PATH_SEGMENT_WIDTH, User, Post, Board
+
+Follow = User.following.through
+
+
+# When a comment is deleted (directly or through a cascade),
+# decrement its parent post's comment counter
+@receiver(post_delete, sender=Post)
+def decrement_comment_count(sender, instance, **kwargs):
+    if instance.parent_id is not None:
+        Post.objects.filter(pk=instance.parent_id, comment_count__gt=0) \
+            .update(comment_count=F("comment_count") - 1)
+        Post.objects.filter(pk=instance.parent_id).refresh_scores()
+
+
+# When a post or comment is deleted, decrement its board's counter. If
+# it was the board's latest post, deleting it has cleared the board's
+# last_post, so look up the latest of the remaining posts
+@receiver(post_delete, sender=Post)
+def update_board_stats(sender, instance, **kwargs):
+    counter = "post_count" if instance.parent_id is None else "comment_count"
+    Board.objects.filter(pk=instance.board_id, **{f"{counter}__gt": 0}) \
+        .update(**{counter: F(counter) - 1})
+    latest = Post.objects.filter(board=OuterRef("pk")).order_by("-id")
+    Board.objects.filter(pk=instance.board_id, last_post=None).update(
+        last_post=Subquery(latest.values("pk")[:1]),
+        last_post_at=Subquery(latest.values("timestamp")[:1]))
+
+
+# When a user is deleted, their likes are removed along with them.
+# Decrement the like counter of every post they liked before the
+# rows in the likes table disappear
+@receiver(pre_delete, sender=User)
+def decrement_like_counts(sender, instance, **kwargs):
+    Post.objects.filter(like_users=instance, like_count__gt=0) \
+        .update(like_count=F("like_count") - 1)
+    Post.objects.filter(like_users=instance).refresh_scores()
+
+
+# When a user is deleted, their follows are removed along with them.
+# Decrement the counters of the users they followed and of the users
+# following them
+@receiver(pre_delete, sender=User)
+def decrement_follow_counts(sender, instance, **kwargs):
+    User.objects.filter(following_users=instance, follower_count__gt=0) \
+        .update(follower_count=F("follower_count") - 1)
+    User.objects.filter(following=instance, following_count__gt=0) \
+        .update(following_count=F("following_count") - 1)
+
+
+# Return the cache namespaces of every page that shows a post: its
+# board, its author's profile and its thread page, and for comments
+# the parent post's author (whose comment count changes) and the
+# thread pages of every ancestor, each of which shows the comment
+def post_namespaces(post_id):
+    post = Post.objects.filter(pk=post_id).values(
+        "board_id", "parent_id", "author__username",
+        "parent__author__username", "parent__path").first()
+    if post is None:
+        return []
+    names = [
+        f"board:{post['board_id']}",
+        f"user:{post['author__username']}",
+        f"thread:{post_id}"
+    ]
+    if post["parent_id"] is not None:
+        names.append(f"user:{post['parent__author__username']}")
+        path = post["parent__path"]
+        names.extend(
+            f"thread:{int(path[start:start + PATH_SEGMENT_WIDTH])}"
+            for start in range(0, len(path), PATH_SEGMENT_WIDTH))
+    return names
+
+
+# Bump the given namespaces once the current transaction commits, so a
+# concurrent request cannot cache the old content again in between
+def invalidate(names):
+    if names:
+        transaction.on_commit(lambda: cache.bump(*names))
+
+
+# Invalidate cached pages when a post or comment is created or edited.
+# The board list shows each board's statistics and latest post, so it
+# is invalidated too
+@receiver(post_save, sender=Post)
+def invalidate_saved_post(sender, instance, **kwargs):
+    invalidate(["boards", *post_namespaces(instance.pk)])
+
+
+# Invalidate cached pages before a post or comment is deleted, while
+# its board and author can still be looked up
+@receiver(pre_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    invalidate(["boards", *post_namespaces(instance.pk)])
+
+
+# Invalidate both profiles when a user follows or unfollows another,
+# since profiles show follower and following counts
+@receiver(m2m_changed, sender=Follow)
+def invalidate_follow(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    usernames = {instance.username}
+    if pk_set:
+        usernames.update(
+            User.objects.filter(pk__in=pk_set)
+            .values_list("username", flat=True))
+    invalidate([f"user:{username}" for username in usernames])
+
+
+# Invalidate the board list and the board's page when a board changes
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+def invalidate_board(sender, instance, **kwargs):
+    invalidate(["boards", f"board:{instance.pk}"])
+
+
+# Generate resized renditions in the background when a post, comment
+# or board is saved with a new image
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Board)
+def schedule_renditions(sender, instance, **kwargs):
+    if images.needs_renditions(instance):
+        tasks.enqueue(
+            images.generate_renditions, instance._meta.label, instance.pk)
+
+
+# Resolve the metadata of a post's video in the background when a post
+# or comment is saved with a new video link
+@receiver(post_save, sender=Post)
+def schedule_video_metadata(sender, instance, **kwargs):
+    if embeds.needs_metadata(instance):
+        tasks.enqueue(embeds.resolve_video, instance.pk)
+
+
+# Keep the full-text search index in step with post content. Saves
+# that only touch other fields (update_fields) are skipped
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or "content" in update_fields:
+        search.index_post(instance.pk, instance.content)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+# Push new posts and comments to the live streams of the pages that
+# show them
+@receiver(post_save, sender=Post)
+def publish_created_post(sender, instance, created, **kwargs):
+    if created:
+        events.post_created(instance.pk)
+
+
+# Count created posts and comments for the activity metrics
+@receiver(post_save, sender=Post)
+def count_created_post(sender, instance, created, **kwargs):
+    if created:
+        kind = "post" if instance.parent_id is None else "comment"
+        metrics.POSTS_CREATED.labels(kind).inc()
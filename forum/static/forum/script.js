@@ -35,6 +35,22 @@ document.addEventListener('click', event => {
         create_comment();
     }
 
+    // User clicks Reply on a comment
+    if (element.classList.contains('reply-button')) {
+        show_reply_form(item);
+    }
+
+    // User submits a reply to a comment
+    if (element.classList.contains('submit-reply')) {
+        create_reply(element.closest('.comment-div'));
+    }
+
+    // User clicks a video or song preview
+    const facade_button = element.closest('.video-facade-button');
+    if (facade_button) {
+        load_video(facade_button.parentNode);
+    }
+
     // User clicks Like button 
     if (element.id === 'like-button') {
         like_item(item);
@@ -48,6 +64,73 @@ document.addEventListener('click', event => {
 });
 
 
+// Forms that create boards and posts upload their image directly to
+// storage before submitting. The form is then sent with the image's
+// storage name instead of the file, so the upload never passes through
+// the app server. If the direct upload fails the file is sent as usual
+document.addEventListener('submit', event => {
+    const form = event.target;
+    const file_input = form.querySelector('input[type="file"]');
+    const thumb_name = form.querySelector('input[name="thumb_name"]');
+    if (!file_input || !thumb_name || !file_input.files[0]) {
+        return;
+    }
+    event.preventDefault();
+    direct_upload(file_input.files[0])
+    .then(name => {
+        if (name) {
+            thumb_name.value = name;
+            file_input.value = '';
+        }
+    })
+    .catch(error => {
+        console.log('Error:', error);
+    })
+    .finally(() => {
+        form.submit();
+    });
+});
+
+
+// Board and thread pages receive new posts, comments and like counts
+// as they happen from their live event stream. Browsers reconnect on
+// their own if the stream drops. Servers that cannot hold streams open
+// answer with an error status, and the page stays static
+document.addEventListener('DOMContentLoaded', () => {
+    const page = document.querySelector('[data-events]');
+    if (!page || !window.EventSource) {
+        return;
+    }
+    const source = new EventSource(page.dataset["events"]);
+    source.addEventListener('post', () => show_new_posts_notice());
+    source.addEventListener('comment', event => {
+        add_live_comment(JSON.parse(event.data));
+    });
+    source.addEventListener('likes', event => {
+        const counts = JSON.parse(event.data).counts;
+        Object.entries(counts).forEach(([item_id, like_count]) => {
+            document.querySelectorAll(`[data-post="${item_id}"], [data-comment="${item_id}"]`)
+            .forEach(item => {
+                const count = item.querySelector('.post-likecount');
+                if (count) {
+                    count.innerHTML = like_count;
+                }
+            });
+        });
+    });
+});
+
+
+// Pages restored from the back/forward cache show the like state from
+// when they were first rendered. Refresh every item on the page with a
+// single request to the like state route
+window.addEventListener('pageshow', event => {
+    if (event.persisted) {
+        refresh_like_states();
+    }
+});
+
+
 // Updates the DOM when the user clicks the Edit button
 function edit_item(item) {
 
@@ -69,58 +152,49 @@ function edit_item(item) {
     image_link_field.id = 'image-upload-button';
     image_link_field.style = 'margin-left:7px';
 
-    // Store the item ID (comment or post ID)
-    var item_id;
-    if (item.className === 'post-div') {
-        item_id = parseInt(item.dataset["post"]);
-    }
-    else if (item.className === 'comment-div') {
-        item_id = parseInt(item.dataset["comment"]);
-    }
-
-    // Make a GET request to the item's route to retrieve
-    // the item's embedded media link. A GET request is required
-    // here (instead of extracting the link from the iframe) because
-    // the link in the iframe is changed after the original post is made,
-    // creating problems when editing SoundCloud songs
-    var item_video_link;
-    const item_api_route = `/forum/${item_id}`;
-    fetch(item_api_route)
-
-    // Convert response to JSON data
-    .then(response => response.json())
+    // Read the item's embedded media link from the video element. The
+    // original link is stored in data-video because the player URL
+    // differs from it (SoundCloud in particular)
+    const item_video = item.querySelector('.video-embedded');
+    const video_link_field = document.createElement('textarea');
+    video_link_field.id = 'post-textarea-small';
+    video_link_field.placeholder = 'Add a link to a YouTube video or SoundCloud song (optional). \
+                                    You will need to refresh the page to view the updated media.';
+    video_link_field.textContent = item_video ? item_video.dataset["video"] : '';
+
+    // Replace the item content with the pre-populated textarea and add
+    // other fields
+    item.replaceChild(edit_text_area, item_content);
+    item.insertBefore(img_label, timestamp);
+    item.insertBefore(image_link_field, timestamp);
+    item.insertBefore(video_link_field, timestamp);
+
+    // Create a Save button for saving edits
+    const save_button = document.createElement('button');
+    save_button.className = 'btn btn-outline-primary';
+    save_button.id = 'submit-post-comment';
+    save_button.innerHTML = 'Save Edits';
+    item.insertBefore(save_button, timestamp);
+
+    // Remove the Edit button
+    item.removeChild(item.querySelector('.btn-outline-warning'));
+}
 
-    // Store the embedded link
-    .then(data => {
-        item_video_link = data.video;
-        const video_link_field = document.createElement('textarea');
-        video_link_field.id = 'post-textarea-small';
-        video_link_field.placeholder = 'Add a link to a YouTube video or SoundCloud song (optional). \
-                                        You will need to refresh the page to view the updated media.';
-        video_link_field.innerHTML = item_video_link;
-
-        // Replace the item content with the pre-populated textarea and add
-        // other fields
-        item.replaceChild(edit_text_area, item_content);
-        item.insertBefore(img_label, timestamp);
-        item.insertBefore(image_link_field, timestamp);
-        item.insertBefore(video_link_field, timestamp);
-
-        // Create a Save button for saving edits
-        const save_button = document.createElement('button');
-        save_button.className = 'btn btn-outline-primary';
-        save_button.id = 'submit-post-comment';
-        save_button.innerHTML = 'Save Edits';
-        item.insertBefore(save_button, timestamp);
-
-        // Remove the Edit button
-        item.removeChild(item.querySelector('.btn-outline-warning'));
-    })
 
-    // Error handling
-    .catch(error => {
-        console.log('Error:', error);
-    });
+// Replaces a video or song preview with the provider's player. The
+// player is only loaded when the reader clicks the preview, and starts
+// playing straight away
+function load_video(facade) {
+    const embed_url = new URL(facade.dataset["embed"]);
+    embed_url.searchParams.set('autoplay', '1');
+    const iframe = document.createElement('iframe');
+    iframe.src = embed_url.toString();
+    iframe.width = 420;
+    iframe.height = 315;
+    iframe.allow = 'autoplay; encrypted-media; fullscreen';
+    iframe.setAttribute('frameborder', '0');
+    iframe.setAttribute('allowfullscreen', '');
+    facade.replaceChild(iframe, facade.querySelector('.video-facade-button'));
 }
 
 
@@ -166,7 +240,6 @@ function save_edits(item) {
     // and video files if they exist
     var form_data = new FormData();
     form_data.append('content', new_content);
-    form_data.append('img_file', item.querySelector('#image-upload-button').files[0]);
     form_data.append('video_link', item_video_upload);
     
     // Create a boolean variable that indicates whether the user uploaded a new image  
@@ -178,8 +251,10 @@ function save_edits(item) {
         uploaded_new_img = false;
     }
 
-    // Use Ajax to make a PUT request that includes the content, image file, and video link
-    $.ajax({ 
+    // Upload the image directly to storage, then use Ajax to make a PUT
+    // request that includes the content, image, and video link
+    append_image(form_data, item.querySelector('#image-upload-button').files[0])
+    .then(form_data => $.ajax({ 
         url: `/forum/${item_id}`,  
         type: 'PUT',
         headers: {
@@ -205,8 +280,14 @@ function save_edits(item) {
             item.removeChild(item.querySelector('.btn-outline-primary'));
 
             // Check if the post already has an image and video and create an Edit button
-            // to be added later
+            // to be added later. Responsive images are wrapped in a picture element whose
+            // sources would override a new src, so unwrap the image first
             var item_image = item.querySelector('.post-img');
+            if (item_image && item_image.parentNode.tagName === 'PICTURE') {
+                item_image.removeAttribute('width');
+                item_image.removeAttribute('height');
+                item_image.parentNode.replaceWith(item_image);
+            }
             const item_video = item.querySelector('.video-embedded');
             const edit_button = document.createElement('button');
             edit_button.className = 'btn btn-outline-warning';
@@ -286,7 +367,7 @@ function save_edits(item) {
         error: function(error) {
             console.log('Error:', error);
         }
-    });
+    }));
 }
 
 
@@ -323,12 +404,13 @@ function create_comment() {
     // Store the form data in a FormData object
     var form_data = new FormData();
     form_data.append('content', content);
-    form_data.append('img_file', document.querySelector('#image-upload-button').files[0]);
     form_data.append('video_link', item_video_upload);
     form_data.append('csrfmiddlewaretoken', csrftoken)
 
-    // Use Ajax to make a POST request that includes the content and image file
-    $.ajax({ 
+    // Upload the image directly to storage, then use Ajax to make a POST
+    // request that includes the content and image
+    append_image(form_data, document.querySelector('#image-upload-button').files[0])
+    .then(form_data => $.ajax({ 
         url: `/forum/comment/compose/${post_id}`,  
         type: 'POST',
         data: form_data,
@@ -343,46 +425,261 @@ function create_comment() {
             document.querySelector('#post-textarea').value = '';
             document.querySelector('#image-upload-button').value = '';
 
-            // Increase the comment number displayed in the Comments button
-            var comment_button = document.querySelector('#comment-button');
-            var comment_number = parseInt(comment_button.innerText.slice(10));
-            comment_number += 1;
-            comment_button.innerHTML = `Comments (${comment_number})`;
-
-            // Add a new comment element to the DOM
-            var parent_element = document.querySelectorAll('.post-div')[1];
-            var new_comment = document.createElement('div');
-            new_comment.className = 'comment-div';
-            new_comment.setAttribute('data-comment', data.id);
-            new_comment.innerHTML = `<h5><a href="${data.author}" class="post-user">${data.author}</a></h5>`;
-            new_comment.innerHTML += `<button type="button" class="btn btn-outline-warning">Edit</button>`;
-            if (data.thumb) {
-                new_comment.innerHTML += `<img class="post-img" src=${data.thumb}>`;
-            }
-            new_comment.innerHTML += `<p class="post-content">${data.content}</p>`;
-            new_comment.innerHTML += `<p class="post-timestamp">${data.timestamp}</p>`;
-            new_comment.innerHTML += `<button class="btn" id="like-button"><i class='far fa-thumbs-up' id="like-icon"></i></button>`;
-
-            // Setting the margin of the like count does not work without specifying it 
-            // in JavaScript. Added a style attribute here to fix this issue
-            new_comment.innerHTML += `<p class="post-likecount" style="margin-left: 6.5px">0</p>`;
-            new_comment.innerHTML += `<hr>`;
-            parent_element.insertBefore(new_comment, parent_element.children[6]);
+            // Add a new comment element to the DOM, unless the live
+            // event stream already did
+            insert_comment(data);
+        },
+        error: function(error) {
+            console.log('Error:', error);
+        }
+    }));
+}
+
+
+// Adds a new comment on the page's post above the other comments and
+// increases the number in the Comments button. Comments that are
+// already on the page are skipped
+function insert_comment(data) {
+    if (document.querySelector(`[data-comment="${data.id}"]`)) {
+        return;
+    }
+    var parent_element = document.querySelectorAll('.post-div')[1];
+    const first_comment = parent_element.querySelector('.comment-div');
+    const element = comment_element(data, 1);
+    if (first_comment) {
+        parent_element.insertBefore(element, first_comment);
+    } else {
+        parent_element.appendChild(element);
+    }
+
+    // Increase the comment number displayed in the Comments button
+    var comment_button = document.querySelector('#comment-button');
+    if (comment_button) {
+        var comment_number = parseInt(comment_button.innerText.slice(10));
+        comment_number += 1;
+        comment_button.innerHTML = `Comments (${comment_number})`;
+    }
+}
+
+
+// Adds a reply to a comment after the comment's other replies, unless
+// it is already on the page
+function insert_reply(item, data) {
+    if (document.querySelector(`[data-comment="${data.id}"]`)) {
+        return;
+    }
+
+    // The comment's replies follow it with a deeper level
+    const level = parseInt(item.dataset["level"]);
+    var last = item;
+    while (last.nextElementSibling &&
+           parseInt(last.nextElementSibling.dataset["level"]) > level) {
+        last = last.nextElementSibling;
+    }
+    last.after(comment_element(data, level + 1));
+}
+
+
+// Adds a comment received from the live event stream to the thread,
+// if the page shows the post or comment it replies to
+function add_live_comment(data) {
+    const post_id = document.querySelector('.post-div').dataset["post"];
+    if (String(data.parent) === post_id) {
+        insert_comment(data);
+        return;
+    }
+    const parent = document.querySelector(`.comment-div[data-comment="${data.parent}"]`);
+    if (parent) {
+        insert_reply(parent, data);
+    }
+}
+
+
+// Shows how many posts were made on the board since the page loaded,
+// with a link that reloads the board
+function show_new_posts_notice() {
+    const notice = document.querySelector('.new-posts-notice');
+    if (!notice) {
+        return;
+    }
+    const count = parseInt(notice.dataset["count"] || '0') + 1;
+    notice.dataset["count"] = count;
+    notice.textContent = `${count} new post${count === 1 ? '' : 's'}. Show ${count === 1 ? 'it' : 'them'}`;
+    notice.hidden = false;
+}
+
+
+// Escapes text for use in HTML. Comments from the live event stream
+// are written by other users
+function escape_html(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
+
+// Creates the element of a comment that was just created, at the
+// given level of the thread (1 for comments on the post). The Edit
+// button is only shown on the viewer's own comments
+function comment_element(data, level) {
+    const author = escape_html(data.author);
+    const viewer = document.querySelector('.posts-page').dataset["viewer"];
+    var new_comment = document.createElement('div');
+    new_comment.className = 'comment-div';
+    new_comment.setAttribute('data-comment', data.id);
+    new_comment.setAttribute('data-level', level);
+    new_comment.innerHTML = `<h5><a href="/${author}" class="post-user">${author}</a></h5>`;
+    if (data.author === viewer) {
+        new_comment.innerHTML += `<button type="button" class="btn btn-outline-warning">Edit</button>`;
+    }
+    if (data.thumb) {
+        new_comment.innerHTML += `<img class="post-img" src="${escape_html(data.thumb)}">`;
+    }
+    new_comment.innerHTML += `<p class="post-content">${escape_html(data.content)}</p>`;
+    new_comment.innerHTML += `<p class="post-timestamp">${data.timestamp}</p>`;
+    if (viewer) {
+        new_comment.innerHTML += `<button class="btn" id="like-button"><i class='far fa-thumbs-up' id="like-icon"></i></button>`;
+
+        // Setting the margin of the like count does not work without specifying it 
+        // in JavaScript. Added a style attribute here to fix this issue
+        new_comment.innerHTML += `<p class="post-likecount" style="margin-left: 6.5px">${data.like_count}</p>`;
+        new_comment.innerHTML += `<button type="button" class="btn btn-outline-secondary reply-button">Reply</button>`;
+    }
+    new_comment.innerHTML += `<hr>`;
+    return new_comment;
+}
+
+
+// Shows a form below a comment for replying to it
+function show_reply_form(item) {
+    if (item.querySelector('.reply-form')) {
+        item.querySelector('.reply-textarea').focus();
+        return;
+    }
+    const form = document.createElement('div');
+    form.className = 'reply-form';
+    form.innerHTML = `<textarea class="reply-textarea" placeholder="Write a reply..."></textarea>`;
+    form.innerHTML += `<button type="button" class="btn btn-info submit-reply">Reply</button>`;
+    item.insertBefore(form, item.querySelector('hr'));
+    form.querySelector('.reply-textarea').focus();
+}
+
+
+// Creates a reply to a comment by making an API call to the comments
+// route, and adds it to the DOM after the comment's other replies
+function create_reply(item) {
+    const form = item.querySelector('.reply-form');
+    const content = form.querySelector('.reply-textarea').value;
+    if (!content || content.length > 1000) {
+        return;
+    }
+    var form_data = new FormData();
+    form_data.append('content', content);
+    form_data.append('csrfmiddlewaretoken', csrftoken);
+    $.ajax({
+        url: `/forum/comment/compose/${item.dataset["comment"]}`,
+        type: 'POST',
+        data: form_data,
+        processData: false,
+        contentType: false,
+        success: function(data) {
+            form.remove();
+            insert_reply(item, data);
         },
         error: function(error) {
             console.log('Error:', error);
         }
     });
 }
+
+
+// Uploads an image file directly to storage (S3, or the app's upload
+// route when files are stored locally) and resolves with its storage
+// name. The file's SHA-256 hash is sent first, so an image that is
+// already stored is not uploaded again. Resolves with null when the
+// browser cannot hash files (outside of HTTPS)
+function direct_upload(file) {
+    if (!window.crypto || !window.crypto.subtle) {
+        return Promise.resolve(null);
+    }
+    return file.arrayBuffer()
+    .then(buffer => crypto.subtle.digest('SHA-256', buffer))
+
+    // Ask the server where to upload the file
+    .then(digest => {
+        const sha256 = Array.from(new Uint8Array(digest))
+            .map(byte => byte.toString(16).padStart(2, '0'))
+            .join('');
+        return fetch('/forum/uploads', {
+            headers: {
+                'X-CSRFToken': csrftoken,
+                'Content-Type': 'application/json'
+            },
+            method: 'POST',
+            body: JSON.stringify({
+                sha256: sha256,
+                size: file.size,
+                filename: file.name,
+                content_type: file.type
+            })
+        });
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error(`Upload could not be started (${response.status})`);
+        }
+        return response.json();
+    })
+
+    // Upload the file unless an identical image is already stored
+    .then(data => {
+        if (!data.upload_url) {
+            return data.name;
+        }
+        return fetch(data.upload_url, {
+            headers: data.headers,
+            method: 'PUT',
+            body: file
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Upload failed (${response.status})`);
+            }
+            return data.name;
+        });
+    });
+}
+
+
+// Adds an image to a FormData object as the storage name of a direct
+// upload or, if the direct upload fails, as the file itself
+function append_image(form_data, file) {
+    if (!file) {
+        return Promise.resolve(form_data);
+    }
+    return direct_upload(file)
+    .catch(error => {
+        console.log('Error:', error);
+        return null;
+    })
+    .then(name => {
+        if (name) {
+            form_data.append('thumb_name', name);
+        }
+        else {
+            form_data.append('img_file', file);
+        }
+        return form_data;
+    });
+}
     
 
 // Updates a user's likes and updates the DOM when 
 // the user likes a post or comment   
 function like_item(item) {
     
-    // Store the item ID and viewer's username for 
-    // requests. Also create a boolean that indicates whether the 
-    // viewer has liked the item and store the user API route
+    // Store the item ID and check whether the viewer has already
+    // liked the item (a solid thumbs-up icon marks a liked item)
     var item_id;
     if (item.className === 'post-div') {
         item_id = parseInt(item.dataset["post"]);
@@ -390,39 +687,24 @@ function like_item(item) {
     else if (item.className === 'comment-div') {
         item_id = parseInt(item.dataset["comment"]);
     }
-    const viewer_name = document.querySelector('.posts-page').dataset["viewer"];
-    var already_liked = false;
-    const user_api_route = `/forum/${viewer_name}`;
+    const like_icon = item.querySelector('#like-icon');
+    const already_liked = like_icon.classList.contains('fas');
 
-    // Make a GET request to the username's route to see
-    // if the user has liked the post or comment
-    fetch(user_api_route)
+    // Send a single request to the item's like route. POST adds
+    // the like and DELETE removes it
+    fetch(`/forum/${item_id}/like`, {
+        headers: {
+            'X-CSRFToken': csrftoken
+        },
+        method: already_liked ? 'DELETE' : 'POST'
+    })
 
     // Convert response to JSON data
     .then(response => response.json())
 
-    // Update the boolean variable if the user has
-    // already liked the post or comment
-    .then(user => {
-        user.likes.forEach(function(liked_post) {
-            if (liked_post.id == item_id) {
-                already_liked = true;
-            }
-        }); 
-
-        // Send a PUT request to the viewer's route
-        return fetch(user_api_route, {
-            headers: {
-                'X-CSRFToken': csrftoken
-            },
-            method: 'PUT',
-            body: JSON.stringify({
-                post_id: item_id
-            })
-        })
-    })
-    .then(() => {
-        update_like_count(item, already_liked);
+    // Update the DOM with the like state and count returned by the server
+    .then(data => {
+        update_like_count(item, data.liked, data.like_count);
     })
 
     // Error handling
@@ -432,18 +714,47 @@ function like_item(item) {
 }
 
 
-// Updates an item's like count in the DOM
-function update_like_count(item, already_liked) {
-    var like_count_element = item.querySelector('.post-likecount');
-    var like_count = parseInt(like_count_element.innerHTML);
-    if (already_liked) {
-        like_count -= 1;
-        like_count_element.innerHTML = like_count;
-    }
-    else {
-        like_count += 1;
-        like_count_element.innerHTML = like_count;
+// Fetches the viewer's like state and the like counts for every
+// post and comment on the page in one request and updates the DOM
+function refresh_like_states() {
+
+    // Collect the items that have a like button
+    var items = {};
+    document.querySelectorAll('.post-div, .comment-div').forEach(item => {
+        const item_id = item.dataset["post"] || item.dataset["comment"];
+        if (item_id && item.querySelector('#like-icon')) {
+            items[item_id] = item;
+        }
+    });
+    const item_ids = Object.keys(items);
+    if (item_ids.length === 0) {
+        return;
     }
+    fetch(`/forum/posts/likes?ids=${item_ids.join(',')}`)
+
+    // Convert response to JSON data
+    .then(response => response.json())
+
+    // Update each item with its current like state and count
+    .then(data => {
+        data.posts.forEach(post => {
+            update_like_count(items[post.id], post.liked, post.like_count);
+        });
+    })
+
+    // Error handling
+    .catch(error => {
+        console.log('Error:', error);
+    });
+}
+
+
+// Updates an item's like icon and like count in the DOM
+function update_like_count(item, liked, like_count) {
+    const like_icon = item.querySelector('#like-icon');
+    like_icon.classList.toggle('fas', liked);
+    like_icon.classList.toggle('far', !liked);
+    item.querySelector('.post-likecount').innerHTML = like_count;
 }
 
 
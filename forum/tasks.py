@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Background tasks run on a small pool of worker threads in each server
+# process, off the request thread. Work that is CPU-bound in C code
+# (Pillow resizing and encoding) releases the GIL, so the pool does not
+# hold up requests. Set FORUM_TASKS_EAGER to run tasks inline instead,
+# which is what the tests do
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+# Return this process's pool, creating it on first use. A worker forked
+# from a process that already had a pool (Gunicorn with preload_app)
+# inherits the pool but not its threads, so it creates its own
+def get_executor():
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.FORUM_TASK_WORKERS,
+                thread_name_prefix="forum-task")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+# Run func(*args) in the background once the current transaction
+# commits, so the task sees the rows the request just wrote
+def enqueue(func, *args):
+    def submit():
+        if settings.FORUM_TASKS_EAGER:
+            run(func, *args)
+        else:
+            get_executor().submit(run, func, *args)
+    transaction.on_commit(submit)
+
+
+# Run a task, logging any failure. Worker threads open their own
+# database connections, which are closed again when the task finishes
+def run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background task %s failed", func.__name__)
+    finally:
+        if not settings.FORUM_TASKS_EAGER:
+            close_old_connections()
@@ -0,0 +1,48 @@
+from django import template
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.utils.html import format_html
+
+register = template.Library()
+
+# Only web links are rendered as links, so a stored javascript: link
+# cannot run in the reader's page
+validate_link = URLValidator(schemes=["http", "https"])
+
+
+# {% video_embed post %}
+#
+# Renders a post's video or song from its stored metadata (see
+# forum/embeds.py) as a click-to-load facade: the provider's thumbnail
+# and title in a button that script.js swaps for the player iframe when
+# clicked. Until the metadata is resolved, or if the provider is not
+# supported, the link itself is shown, if it is a web link. data-video
+# carries the original link for the edit form
+@register.simple_tag
+def video_embed(post):
+    meta = post.video_meta or {}
+    if meta.get("source") != post.video or not meta.get("embed_url"):
+        try:
+            validate_link(post.video)
+        except ValidationError:
+            return ""
+        return format_html(
+            '<div class="video-embedded" data-video="{}">'
+            '<a href="{}" target="_blank" rel="noopener">{}</a></div>',
+            post.video, post.video, post.video)
+    title = meta.get("title") or meta["provider"].title()
+    if meta.get("thumbnail"):
+        preview = format_html(
+            '<img src="{}" alt="" width="420" height="315" '
+            'loading="lazy" decoding="async">',
+            meta["thumbnail"])
+    else:
+        preview = ""
+    return format_html(
+        '<div class="video-embedded video-facade" data-video="{}" '
+        'data-embed="{}">'
+        '<button type="button" class="video-facade-button" '
+        'aria-label="Play {}">{}<span class="video-facade-play">'
+        '<i class="fas fa-play"></i></span></button>'
+        '<p class="video-title">{}</p></div>',
+        post.video, meta["embed_url"], title, preview, title)
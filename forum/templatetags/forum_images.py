@@ -0,0 +1,37 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+# {% responsive_image post "post-img" %}
+#
+# Renders an object's image. Once background renditions exist (see
+# forum/images.py) the image is wrapped in a <picture> element with an
+# AVIF and a WebP srcset so browsers download the smallest file that
+# fits, and the intrinsic width and height are set to avoid layout
+# shifts. The original stays as the fallback src. Images always load
+# lazily
+@register.simple_tag
+def responsive_image(obj, css_class, sizes="(max-width: 768px) 100vw, 768px"):
+    thumb = obj.thumb
+    meta = obj.thumb_meta or {}
+    if meta.get("source") != thumb.name or not meta.get("renditions"):
+        return format_html(
+            '<img class="{}" src="{}" loading="lazy" decoding="async">',
+            css_class, thumb.url)
+
+    # Group the renditions into one srcset per format
+    srcsets = {}
+    for rendition in meta["renditions"]:
+        srcsets.setdefault(rendition["format"], []).append(
+            f"{default_storage.url(rendition['name'])} {rendition['width']}w")
+    sources = format_html_join(
+        "", '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((image_format, ", ".join(srcset), sizes)
+         for image_format, srcset in srcsets.items()))
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" width="{}" height="{}" '
+        'loading="lazy" decoding="async"></picture>',
+        sources, css_class, thumb.url, meta["width"], meta["height"])
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from .models import User, Post, TimelineEntry
+
+Follow = User.following.through
+
+
+# Return the IDs of authors with more followers than the fan-out limit.
+# Their posts are read from the posts table when a follower opens the
+# Following page instead of being copied into every follower's timeline.
+# The set is small and changes slowly, so it is cached for a few minutes
+def high_follower_ids():
+    key = "forum:timeline:high-follower-ids"
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(
+            User.objects
+            .filter(follower_count__gt=settings.FORUM_TIMELINE_FANOUT_LIMIT)
+            .values_list("pk", flat=True))
+        cache.set(key, ids, 300)
+    return ids
+
+
+# Copy a new top-level post into the timeline of each of its author's
+# followers and trim their timelines back to their maximum length
+def fan_out(post):
+    if post.parent_id is not None or post.author_id in high_follower_ids():
+        return
+    follower_ids = Follow.objects.filter(to_user_id=post.author_id) \
+        .values_list("from_user_id", flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post,
+                          timestamp=post.timestamp)
+            for user_id in follower_ids.iterator()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True)
+    trim(follower_ids)
+
+
+# Add the newest posts of a newly followed author to the follower's
+# timeline and trim the timeline back to its maximum length
+def backfill(user, author):
+    if author.pk in high_follower_ids():
+        return
+    posts = Post.objects.filter(author=author, parent=None) \
+        .order_by("-timestamp", "-id") \
+        .values_list("id", "timestamp")[:settings.FORUM_TIMELINE_MAX_ENTRIES]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, post_id=post_id, timestamp=timestamp)
+            for post_id, timestamp in posts
+        ],
+        batch_size=1000,
+        ignore_conflicts=True)
+    trim([user.pk])
+
+
+# Replace a user's timeline with the newest posts of every author they
+# follow, read in one query
+def rebuild(user):
+    posts = Post.objects.filter(author__following_users=user, parent=None) \
+        .exclude(author__in=high_follower_ids()) \
+        .order_by("-timestamp", "-id") \
+        .values_list("id", "timestamp")[:settings.FORUM_TIMELINE_MAX_ENTRIES]
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user=user).delete()
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user=user, post_id=post_id, timestamp=timestamp)
+                for post_id, timestamp in posts
+            ],
+            batch_size=1000)
+
+
+# Remove an unfollowed author's posts from the follower's timeline
+def remove(user, author):
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+# Delete the entries beyond the newest FORUM_TIMELINE_MAX_ENTRIES of
+# each of the given users' timelines, in one statement
+def trim(user_ids):
+    beyond = TimelineEntry.objects.filter(user_id__in=user_ids) \
+        .annotate(rank=Window(
+            RowNumber(), partition_by=F("user_id"),
+            order_by=(F("timestamp").desc(), F("post_id").desc()))) \
+        .filter(rank__gt=settings.FORUM_TIMELINE_MAX_ENTRIES) \
+        .values("pk")
+    TimelineEntry.objects.filter(pk__in=beyond).delete()
+
+
+# Return the posts on a user's Following page, newest first. Normally
+# this is a single range read over the user's timeline entries. If the
+# user follows high-follower authors, whose posts are not fanned out,
+# their posts are merged in from the posts table
+def following_posts(user):
+    followed = set(user.following.values_list("id", flat=True))
+    pulled = followed & high_follower_ids()
+    if not pulled:
+        return Post.objects.filter(timeline_entries__user=user) \
+            .annotate(
+                feed_timestamp=F("timeline_entries__timestamp"),
+                feed_post=F("timeline_entries__post")) \
+            .order_by("-feed_timestamp", "-feed_post")
+    return Post.objects.filter(
+        Q(pk__in=TimelineEntry.objects.filter(user=user).values("post")) |
+        Q(parent=None, author__in=pulled)
+    ).order_by("-timestamp", "-id")
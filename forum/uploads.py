@@ -0,0 +1,228 @@
+import base64
+import hashlib
+import os
+import re
+import time
+from functools import partial
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler, TemporaryFileUploadHandler)
+from django.middleware.csrf import get_token
+from django.urls import reverse
+from PIL import Image
+from . import metrics
+from .models import Upload
+
+# Images reach storage in one of two ways:
+#
+# - Sent with a form or API request. The hashing upload handlers below
+#   hash each file while Django streams it to memory or a temporary
+#   file, and store() writes it to storage under its hash, or reuses
+#   the stored copy of an identical image.
+# - Uploaded directly. The browser hashes the file and asks for an
+#   upload URL (start()). If the image is already stored no upload is
+#   needed; otherwise the browser PUTs the file to a presigned S3 URL,
+#   or to receive() when storage is the local filesystem. The form is
+#   then submitted with the storage name instead of the file.
+#
+# Either way the stored name is uploads/<hash prefix>/<hash><extension>
+
+CHUNK_SIZE = 64 * 1024
+SIGNING_SALT = "forum.uploads"
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+EXTENSION_PATTERN = re.compile(r"\.[a-z0-9]{1,5}")
+
+
+class UploadError(Exception):
+    pass
+
+
+# Adds SHA-256 hashing to an upload handler. Only the handler that
+# keeps a chunk hashes it, so each file is hashed once
+class HashingMixin:
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            self.sha256.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(
+        HashingMixin, TemporaryFileUploadHandler):
+    pass
+
+
+# Return the SHA-256 hash of an uploaded file, computed by the upload
+# handlers or, for files that did not pass through them, read here
+def file_sha256(file):
+    if getattr(file, "sha256", None):
+        return file.sha256
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks(CHUNK_SIZE):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+# Return the storage name of the image with the given hash
+def storage_name(sha256, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if not EXTENSION_PATTERN.fullmatch(extension):
+        extension = ""
+    return f"uploads/{sha256[:2]}/{sha256}{extension}"
+
+
+# Return True if the name refers to an image stored by either flow
+def is_stored(name):
+    return Upload.objects.filter(name=name).exists() and \
+        default_storage.exists(name)
+
+
+# Write an uploaded file to storage unless an identical image is
+# already stored, and return its storage name
+def store(file):
+    started = time.perf_counter()
+    sha256 = file_sha256(file)
+    metrics.UPLOAD_SIZE.labels("form").observe(file.size)
+    upload = Upload.objects.filter(sha256=sha256).first()
+    if upload is not None and default_storage.exists(upload.name):
+        metrics.UPLOADS_DEDUPLICATED.labels("form").inc()
+        return upload.name
+    name = default_storage.save(storage_name(sha256, file.name), file)
+    upload, created = Upload.objects.get_or_create(
+        sha256=sha256, defaults={"name": name, "size": file.size})
+    if not created and upload.name != name:
+
+        # Another request stored the same image meanwhile: keep its copy.
+        # Or the image was requested for a direct upload that never
+        # arrived: point the record at this copy
+        if default_storage.exists(upload.name):
+            default_storage.delete(name)
+        else:
+            upload.name = name
+            upload.save(update_fields=["name"])
+    metrics.UPLOAD_DURATION.labels("form") \
+        .observe(time.perf_counter() - started)
+    return upload.name
+
+
+# Return the storage name of an image submitted with a request: the
+# file sent in the request body, or the name of a direct upload
+def attach(file=None, name=""):
+    if file:
+        return store(file)
+    return name or None
+
+
+# Start a direct upload of an image with the given hash and size.
+# Returns the storage name and, unless the image is already stored, the
+# URL and headers of the PUT request that uploads it
+def start(request, sha256, size, filename, content_type):
+    if not SHA256_PATTERN.fullmatch(sha256):
+        raise UploadError("Invalid SHA-256 hash.")
+    if not content_type.startswith("image/"):
+        raise UploadError("Only images can be uploaded.")
+    if not 0 < size <= settings.FORUM_MAX_UPLOAD_SIZE:
+        raise UploadError(
+            f"Images must be smaller than "
+            f"{settings.FORUM_MAX_UPLOAD_SIZE // (1024 * 1024)} MB.")
+    upload, created = Upload.objects.get_or_create(
+        sha256=sha256,
+        defaults={"name": storage_name(sha256, filename), "size": size})
+    if not created and default_storage.exists(upload.name):
+        metrics.UPLOADS_DEDUPLICATED.labels("direct").inc()
+        return {"name": upload.name, "upload_url": None, "headers": {}}
+    if upload.size != size:
+        upload.size = size
+        upload.save(update_fields=["size"])
+
+    # S3 checks the file against the hash in the presigned URL and
+    # rejects anything else. The local route checks it in receive()
+    bucket = getattr(default_storage, "bucket", None)
+    if bucket is not None:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = bucket.meta.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": default_storage.bucket_name,
+                "Key": default_storage._normalize_name(upload.name),
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": checksum
+            },
+            ExpiresIn=settings.FORUM_UPLOAD_URL_EXPIRY)
+        headers = {
+            "Content-Type": content_type,
+            "x-amz-checksum-sha256": checksum
+        }
+    else:
+        token = signing.dumps(
+            {"name": upload.name, "sha256": sha256, "size": size},
+            salt=SIGNING_SALT)
+        url = reverse("upload-receive", args=(token,))
+        headers = {
+            "Content-Type": content_type,
+            "X-CSRFToken": get_token(request)
+        }
+    return {"name": upload.name, "upload_url": url, "headers": headers}
+
+
+# Receive a direct upload sent to the local upload route. The request
+# body is read in chunks, hashed and spooled to a temporary file, so it
+# is never held in memory, then written to storage if it matches the
+# hash and size the upload was started with
+def receive(request, token):
+    try:
+        claim = signing.loads(
+            token, salt=SIGNING_SALT,
+            max_age=settings.FORUM_UPLOAD_URL_EXPIRY)
+    except signing.BadSignature:
+        raise UploadError("Invalid or expired upload URL.")
+    name = claim["name"]
+    if default_storage.exists(name):
+        return name
+    if int(request.META.get("CONTENT_LENGTH") or 0) != claim["size"]:
+        raise UploadError("The file size does not match the upload.")
+    started = time.perf_counter()
+    sha256 = hashlib.sha256()
+    file = TemporaryUploadedFile(
+        os.path.basename(name), request.content_type, claim["size"], None)
+    try:
+        for chunk in iter(partial(request.read, CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            file.write(chunk)
+        if sha256.hexdigest() != claim["sha256"]:
+            raise UploadError("The file does not match its SHA-256 hash.")
+        file.seek(0)
+        try:
+            Image.open(file).verify()
+        except Exception:
+            raise UploadError("The file is not an image.")
+        file.seek(0)
+        saved = default_storage.save(name, file)
+        if saved != name:
+            default_storage.delete(saved)
+    finally:
+        file.close()
+    metrics.UPLOAD_SIZE.labels("direct").observe(claim["size"])
+    metrics.UPLOAD_DURATION.labels("direct") \
+        .observe(time.perf_counter() - started)
+    return name
@@ -7,6 +7,8 @@ urlpatterns = [
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
     path("following", views.view_following, name="view-following"),
+    path("search", views.view_search, name="search"),
+    path("metrics", views.view_metrics, name="metrics"),
     path("<str:username>", views.view_user, name="view-user"),
     path("board/<int:board_id>", views.view_board, name="view-board"),
     path(
@@ -15,7 +17,55 @@ urlpatterns = [
         name="view-comments"),
 
     # API Routes
+    path(
+        "forum/boards/<int:board_id>/posts",
+        views.board_feed,
+        name="board-feed"),
     path("forum/<int:post_id>", views.post, name="post"),
+    path("forum/<int:post_id>/like", views.like, name="like"),
+    path(
+        "forum/boards/<int:board_id>/events",
+        views.board_events,
+        name="board-events"),
+    path(
+        "forum/<int:post_id>/events",
+        views.thread_events,
+        name="thread-events"),
+    path("forum/posts/likes", views.like_states, name="like-states"),
+    path(
+        "forum/users/<str:username>/follow",
+        views.follow,
+        name="follow"),
+    path(
+        "forum/users/<str:username>/followers",
+        views.follow_list,
+        {"direction": "followers"},
+        name="followers"),
+    path(
+        "forum/users/<str:username>/following",
+        views.follow_list,
+        {"direction": "following"},
+        name="following"),
+    path("forum/search", views.search_api, name="search-api"),
+    path("forum/cache/stats", views.cache_stats, name="cache-stats"),
+    path("forum/uploads", views.start_upload, name="upload-start"),
+    path(
+        "forum/uploads/<str:token>",
+        views.receive_upload,
+        name="upload-receive"),
+    path(
+        "api/v1/boards/<int:board_id>/posts",
+        views.api_board_posts,
+        name="api-board-posts"),
+    path(
+        "api/v1/posts/<int:post_id>/thread",
+        views.api_thread,
+        name="api-thread"),
+    path(
+        "api/v1/users/<str:username>/posts",
+        views.api_user_posts,
+        name="api-user-posts"),
+    path("api/v1/following", views.api_following, name="api-following"),
     path("forum/<str:username>", views.user, name="user"),
     path(
         "forum/comment/compose/<int:post_id>",
@@ -1,23 +1,52 @@
 import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseRedirect, QueryDict
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django import forms
-from django.forms import ModelForm, Textarea, ClearableFileInput
+from django.forms import ModelForm, Textarea, ClearableFileInput, HiddenInput
+from django.http.multipartparser import MultiPartParserError
+from django.utils.datastructures import MultiValueDict
 from django.core.paginator import Paginator
-from django.db.models import Count
-from .models import User, Post, Board
+from django.db.models import F
+from . import api, events, likes, metrics, search, timeline, uploads, writer
+from .cache import cache_anonymous_page, stats
+from .models import (
+    PATH_SEGMENT_WIDTH, RESERVED_USERNAMES, User, Post, Board)
+from .pagination import CursorPaginator
 from django.http import HttpResponseBadRequest
 
+Follow = User.following.through
+
+
+# Hidden form field that script.js fills in with the storage name of an
+# image uploaded directly to storage, sent in place of the file
+class ThumbNameField(forms.CharField):
+    widget = HiddenInput
+
+    def __init__(self, **kwargs):
+        super().__init__(required=False, **kwargs)
+
+    def validate(self, value):
+        super().validate(value)
+        if value and not uploads.is_stored(value):
+            raise forms.ValidationError("The uploaded image was not found.")
+
 
 # Defines a form for creating posts. Comments are created 
 # using JavaScript
 class NewPostForm(ModelForm):
+    thumb_name = ThumbNameField()
+
     class Meta:
         model = Post
         fields = ['content', 'thumb', 'video']
@@ -47,8 +76,16 @@ class NewPostForm(ModelForm):
         }
 
 
+# Check a video link sent to the JSON routes the way NewPostForm does.
+# Returns the cleaned link or raises ValidationError
+def clean_video_link(value):
+    return Post._meta.get_field("video").formfield().clean(value)
+
+
 # Defines a form for creating a board
 class NewBoardForm(ModelForm):
+    thumb_name = ThumbNameField()
+
     class Meta:
         model = Board
         fields = ['name', 'thumb', 'description']
@@ -78,10 +115,19 @@ class NewBoardForm(ModelForm):
         }
 
 
+# Number of boards listed per index page
+BOARDS_PER_PAGE = 50
+
+
+@cache_anonymous_page(lambda: ["boards"])
 def index(request):
 
-    # Display a list of all of the Boards
-    boards = Board.objects.all()
+    # Display a page of the Boards with their statistics and latest
+    # post, which are stored on each board
+    page_obj = paginate(
+        request,
+        Board.objects.select_related("last_post__author").order_by("id"),
+        BOARDS_PER_PAGE)
 
     # Check if the user has permission to create a new
     # Board. If the user has the required permission,
@@ -99,25 +145,50 @@ def index(request):
         if board.is_valid():
             new_board = Board(
                 name=board.cleaned_data.get("name"),
-                thumb=board.cleaned_data.get("thumb"),
+                thumb=uploads.attach(
+                    board.cleaned_data.get("thumb"),
+                    board.cleaned_data.get("thumb_name")),
                 description=board.cleaned_data.get("description"))
             new_board.save()
             return HttpResponseRedirect(reverse("index"))
         else:
             return render(request, "forum/index.html", {
-                "boards": boards,
+                "page_obj": page_obj,
                 "has_permission": has_permission,
                 "form": board
             })
     return render(request, "forum/index.html", {
-        "boards": boards,
+        "page_obj": page_obj,
         "has_permission": has_permission,
         "form": NewBoardForm()
     })
 
 
+# Orderings for the board sort dropdown (the q GET parameter). Every
+# ordering ends with the post ID so rows have a unique position for
+# cursor pagination
+BOARD_SORTS = {
+    "likes_high_low": ("-like_count", "-id"),
+    "likes_low_high": ("like_count", "id"),
+    "comments_high_low": ("-comment_count", "-id"),
+    "comments_low_high": ("comment_count", "id"),
+    "timestamp_new_old": ("-timestamp", "-id"),
+    "timestamp_old_new": ("timestamp", "id"),
+    "hot": ("-hot_score", "-id"),
+    "trending": ("-trending_score", "-id"),
+}
+DEFAULT_SORT = BOARD_SORTS["timestamp_new_old"]
+
+
+# Save a new post and add it to the author's followers' timelines
+def create_post(post):
+    post.save()
+    timeline.fan_out(post)
+
+
 # View the user sees after clicking on a Board name on the
 # index page
+@cache_anonymous_page(lambda board_id: [f"board:{board_id}"])
 def view_board(request, board_id):
 
     # Variable that is used to display the appropriate elements
@@ -133,34 +204,10 @@ def view_board(request, board_id):
     # Check the sorting criteria. Order the posts accordingly and paginate.
     # If no GET parameter is supplied, set sort to "" (sort by new to old)
     sort = request.GET.get("q", "")
-    if sort == "likes_high_low":
-        posts = board.posts.filter(parent=None) \
-            .annotate(num_likes=Count('like_users')).order_by("-num_likes")
-        page_obj = paginate(request, posts)
-    elif sort == "likes_low_high":
-        posts = board.posts.filter(parent=None) \
-            .annotate(num_likes=Count('like_users')).order_by("num_likes")
-        page_obj = paginate(request, posts)
-    elif sort == "comments_high_low":
-        posts = board.posts.filter(parent=None) \
-            .annotate(num_comments=Count('child_posts')).order_by('-num_comments')
-        page_obj = paginate(request, posts)
-    elif sort == "comments_low_high":
-        posts = board.posts.filter(parent=None) \
-            .annotate(num_comments=Count('child_posts')).order_by('num_comments')
-        page_obj = paginate(request, posts)
-    elif sort == "timestamp_new_old":
-        posts = board.posts.filter(parent=None) \
-            .order_by("-timestamp")
-        page_obj = paginate(request, posts)
-    elif sort == "timestamp_old_new":
-        posts = board.posts.filter(parent=None) \
-            .order_by("timestamp")
-        page_obj = paginate(request, posts)
-    else:
-        posts = board.posts.filter(parent=None) \
-            .order_by("-timestamp")
-        page_obj = paginate(request, posts)
+    posts = board.posts.filter(parent=None) \
+        .for_feed(request.user) \
+        .order_by(*BOARD_SORTS.get(sort, DEFAULT_SORT))
+    page_obj = paginate(request, posts)
 
     # User creates a post
     if request.method == "POST":
@@ -172,9 +219,11 @@ def view_board(request, board_id):
                 author=request.user,
                 board=board,
                 content=post.cleaned_data.get("content"),
-                thumb=post.cleaned_data.get("thumb"),
+                thumb=uploads.attach(
+                    post.cleaned_data.get("thumb"),
+                    post.cleaned_data.get("thumb_name")),
                 video=post.cleaned_data.get("video"))
-            new_post.save()
+            writer.write(create_post, new_post)
             return HttpResponseRedirect(reverse(
                 "view-board",
                 args=(board.id,)))
@@ -183,6 +232,7 @@ def view_board(request, board_id):
                 "board": board,
                 "form": post,
                 "page_obj": page_obj,
+                "sort": sort,
                 "board_page": board_page
             })
     else:
@@ -190,30 +240,87 @@ def view_board(request, board_id):
             "board": board,
             "form": NewPostForm(),
             "page_obj": page_obj,
+            "sort": sort,
             "board_page": board_page
         })
 
 
-# View the user sees after clicking on the Comments button
-# in a post (displays comments)
+# Levels of comments shown below the post of a thread page. Deeper
+# replies are shown on the page of the comment they reply to
+THREAD_DEPTH = 5
+
+
+# Arrange a page of comments and the replies below them in the order
+# they are shown: each comment followed by its replies, depth first.
+# Replies arrive in path order, which is already depth first, so each
+# only needs to be grouped under the page comment it descends from,
+# found from its path. Sets each comment's level below the post and
+# whether it has replies too deep to show
+def arrange_thread(post, comments, replies):
+    start = len(post.path)
+    branches = {comment.id: [] for comment in comments}
+    for reply in replies:
+        branches[int(reply.path[start:start + PATH_SEGMENT_WIDTH])] \
+            .append(reply)
+    thread = []
+    for comment in comments:
+        thread.append(comment)
+        thread.extend(branches[comment.id])
+    for comment in thread:
+        comment.level = comment.depth - post.depth
+        comment.more_replies = \
+            comment.level == THREAD_DEPTH and comment.comment_count > 0
+    return thread
+
+
+# View the user sees after clicking on the Comments button in a post,
+# or on a reply in a thread (displays the comment tree below it). The
+# direct replies are paginated newest first, and the replies below the
+# comments of the page are loaded in one query
+@cache_anonymous_page(lambda post_id: [f"thread:{post_id}"])
 def view_comments(request, post_id):
 
     # Query for requested post
     try:
-        post = Post.objects.get(pk=post_id)
+        post = Post.objects.for_feed(request.user).get(pk=post_id)
     except Post.DoesNotExist:
         return HttpResponse("Error: Post does not exist.")
 
-    # List the comments in reverse chronological order
-    comments = post.child_posts.all().order_by("-timestamp")
+    # List a page of comments in reverse chronological order, each with
+    # the replies below it
+    page_obj = paginate(
+        request,
+        post.child_posts.for_feed(request.user).order_by(*DEFAULT_SORT))
+    replies = Post.objects.for_feed(request.user).descendants(
+        [comment for comment in page_obj if comment.comment_count],
+        THREAD_DEPTH - 1)
+
+    # The close button leads back to the parent's thread or the board
+    if post.parent_id:
+        back_url = reverse("view-comments", args=(post.parent_id,))
+    else:
+        back_url = reverse("view-board", args=(post.board_id,))
     return render(request, "forum/comments.html", {
         "post": post,
+        "back_url": back_url,
         "form": NewPostForm(),
-        "comments": comments
+        "comments": arrange_thread(post, list(page_obj), replies),
+        "page_obj": page_obj
     })
 
 
+# Follow or unfollow a user, adding their recent posts to or removing
+# them from the follower's timeline. Both directions are idempotent
+def set_following(user, author, following):
+    if following:
+        if user.follow(author):
+            timeline.backfill(user, author)
+    elif user.unfollow(author):
+        timeline.remove(user, author)
+
+
 # View the user sees after clicking on a username in a post
+@cache_anonymous_page(lambda username: [f"user:{username}"])
 def view_user(request, username):
 
     # Variable that is used to display the appropriate elements
@@ -226,50 +333,46 @@ def view_user(request, username):
     except User.DoesNotExist:
         return HttpResponse("Error: Page does not exist.")
 
-    # List the posts associated with the profile in reverse chronological
-    # order and paginate
-    profile_posts = user.posts.filter(parent=None) \
-        .order_by("-timestamp")
-    page_obj = paginate(request, profile_posts)
-
     # Check if the user is viewing their own profile
     own_profile = False
     if request.user == user:
         own_profile = True
 
+    # User clicks Follow or Unfollow button. The form says which, so
+    # submitting it again has no further effect, and the redirect keeps
+    # a reload from submitting it at all
+    if request.method == "POST":
+        if not request.user.is_authenticated:
+            return HttpResponseRedirect(reverse("login"))
+        action = request.POST.get("action")
+        if own_profile or action not in ("follow", "unfollow"):
+            return HttpResponseBadRequest("Invalid follow request.")
+        writer.write(set_following, request.user, user, action == "follow")
+        return HttpResponseRedirect(
+            reverse("view-user", args=(user.username,)))
+
+    # List the posts associated with the profile in reverse chronological
+    # order and paginate
+    profile_posts = user.posts.filter(parent=None) \
+        .for_feed(request.user) \
+        .order_by(*DEFAULT_SORT)
+    page_obj = paginate(request, profile_posts)
+
     # Check if the user is already following this profile and
     # set the button text accordingly
-    try:
-        already_following = request.user.following \
-            .filter(username=username).exists()
-
-    # Handles the case where a user is not signed in
-    except:
-        already_following = False
+    already_following = request.user.is_authenticated and not own_profile \
+        and Follow.objects.filter(
+            from_user=request.user, to_user=user).exists()
     if already_following:
         follow_button_text = "Unfollow"
     else:
         follow_button_text = "Follow"
 
-    # User clicks Follow or Unfollow button
-    if request.method == "POST":
-
-        # If the user is already following this profile, remove the
-        # profile from their following field
-        if already_following:
-            request.user.following.remove(user)
-            follow_button_text = "Follow"
-
-        # Otherwise, add the profile to the user's following field
-        else:
-            request.user.following.add(user)
-            follow_button_text = "Unfollow"
-
-    # Check the number of users the user follows (following)
-    # and the number of followers the user has (followers)
-    # and set the grammatical number accordingly
-    followers_count = user.following_users.count()
-    following_count = user.following.count()
+    # Read the number of users the user follows (following) and the
+    # number of followers the user has (followers) from the user's
+    # counters and set the grammatical number accordingly
+    followers_count = user.follower_count
+    following_count = user.following_count
     if followers_count == 1:
         followers_count_text = "1 Follower"
     else:
@@ -284,6 +387,7 @@ def view_user(request, username):
         "followers_count_text": followers_count_text,
         "following_count_text": following_count_text,
         "own_profile": own_profile,
+        "already_following": already_following,
         "follow_button_text": follow_button_text,
         "page_obj": page_obj,
         "user_page": user_page
@@ -296,8 +400,8 @@ def view_following(request):
     # Variable that is used to display the appropriate elements
     # of the posts.html template
     following_page = True
-    following_posts = Post.objects.filter(parent=None) \
-        .filter(author__in=request.user.following.all()).order_by("-timestamp")
+    following_posts = timeline.following_posts(request.user) \
+        .for_feed(request.user)
     page_obj = paginate(request, following_posts)
     return render(request, "forum/posts.html", {
         "page_obj": page_obj,
@@ -305,20 +409,133 @@ def view_following(request):
     })
 
 
-# Paginates a list of posts or comments
-def paginate(request, items):
-    paginator = Paginator(items, 10)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+# Returns the posts and comments matching a search, ranked by
+# relevance. Searches Post.content for the q GET parameter, optionally
+# restricted to one board (board), one author (author) and either
+# top-level posts or comments (type)
+def search_results(request, user):
+    results = Post.objects.all()
+    board_id = request.GET.get("board", "")
+    if board_id.isdigit():
+        results = results.filter(board_id=board_id)
+    author = request.GET.get("author", "").strip()
+    if author:
+        results = results.filter(author__username=author)
+    result_type = request.GET.get("type", "")
+    if result_type == "posts":
+        results = results.filter(parent=None)
+    elif result_type == "comments":
+        results = results.filter(parent__isnull=False)
+    return search.search_posts(request.GET.get("q", ""), results) \
+        .for_feed(user) \
+        .order_by("-search_rank", "-id")
+
+
+# View the user sees after searching. Results are paginated with
+# cursors; the pagination links carry the search parameters along
+def view_search(request):
+    page_obj = CursorPaginator(search_results(request, request.user), 10) \
+        .page(request.GET.get("cursor"))
+    query = request.GET.copy()
+    query.pop("cursor", None)
+    return render(request, "forum/search.html", {
+        "page_obj": page_obj,
+        "boards": Board.objects.order_by("name").only("id", "name"),
+        "q": request.GET.get("q", ""),
+        "board_id": request.GET.get("board", ""),
+        "author": request.GET.get("author", ""),
+        "result_type": request.GET.get("type", ""),
+        "query": query.urlencode()
+    })
+
+
+# Paginates a list of posts, comments or boards. By default pages are
+# addressed with opaque cursors (?cursor=...), which seek directly to
+# the page without counting rows or scanning past an OFFSET. Passing a
+# page number (?page=2) opts into classic numbered pages
+def paginate(request, items, per_page=10):
+    if "page" in request.GET:
+        paginator = Paginator(items, per_page)
+        page_number = request.GET.get('page')
+        return paginator.get_page(page_number)
+    return CursorPaginator(items, per_page).page(request.GET.get("cursor"))
+
+
+# Handles requests to the board feed API route. Returns a page of a
+# board's top-level posts using the same sorts and cursors as the
+# board page. The JSON API views are async: under ASGI they wait on
+# the database without tying up a worker thread
+async def board_feed(request, board_id):
+
+    # Feeds must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+
+    # Query for requested board
+    if not await Board.objects.filter(pk=board_id).aexists():
+        return JsonResponse({"error": "Board not found."}, status=404)
+    sort = request.GET.get("q", "")
+    posts = Post.objects.filter(board_id=board_id, parent=None) \
+        .for_feed(await request.auser()) \
+        .order_by(*BOARD_SORTS.get(sort, DEFAULT_SORT))
+    page_obj = await CursorPaginator(posts, 10) \
+        .apage(request.GET.get("cursor"))
+    return JsonResponse({
+        "posts": [post.serialize() for post in page_obj],
+        "next": page_obj.next_cursor,
+        "previous": page_obj.previous_cursor
+    })
+
+
+# Handles requests to the search API route. Takes the same parameters
+# as the search page and returns a page of results
+async def search_api(request):
+
+    # Searches must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    results = search_results(request, await request.auser())
+    page_obj = await CursorPaginator(results, 10) \
+        .apage(request.GET.get("cursor"))
+    return JsonResponse({
+        "posts": [post.serialize() for post in page_obj],
+        "next": page_obj.next_cursor,
+        "previous": page_obj.previous_cursor
+    })
+
+
+# Handles requests to the cache statistics API route. Returns this
+# process's cache hit and miss counts for staff users
+@login_required
+def cache_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Staff access required."}, status=403)
+    return JsonResponse(stats())
+
+
+# Serves the Prometheus metrics to scrapers that send
+# FORUM_METRICS_TOKEN as a bearer token. Without a token, metrics are
+# only served when DEBUG is on
+def view_metrics(request):
+    token = settings.FORUM_METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse("Forbidden", status=403)
+    elif not constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse("Unauthorized", status=401)
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
 
 
 # Handles requests to the post API route
 @login_required
-def post(request, post_id):
+async def post(request, post_id):
 
     # Query for requested post
     try:
-        post = Post.objects.get(pk=post_id)
+        post = await Post.objects.select_related("author", "board") \
+            .aget(pk=post_id)
     except Post.DoesNotExist:
         return JsonResponse({"error": "Post not found."}, status=404)
 
@@ -326,51 +543,10 @@ def post(request, post_id):
     if request.method == "GET":
         return JsonResponse(post.serialize())
 
-    # Update the post's content, image link, or like count
+    # Update the post's content, image link, or like count. Parsing the
+    # upload and saving run in a worker thread
     elif request.method == "PUT":
-
-        # The below code is used to update image files with PUT requests (this is
-        # not straightforward with Django). Source: 
-        # https://dzone.com/articles/parsing-unsupported-requests-put-delete-etc-in-dja
-        # Bug fix: if _load_post_and_files has already been called, for
-        # example by middleware accessing request.POST, the below code to
-        # pretend the request is a POST instead of a PUT will be too late
-        # to make a difference. Also calling _load_post_and_files will result
-        # in the following exception:
-        # AttributeError: You cannot set the upload handlers after the upload has been processed.
-        # The fix is to check for the presence of the _post field which is set
-        # the first time _load_post_and_files is called (both by wsgi.py and
-        # modpython.py). If it's set, the request has to be 'reset' to redo
-        # the query value parsing in POST mode.
-        if hasattr(request, '_post'):
-            del request._post
-            del request._files
-        try:
-            request.method = "POST"
-            request._load_post_and_files()
-            request.method = "PUT"
-        except AttributeError:
-            request.META['REQUEST_METHOD'] = 'POST'
-            request._load_post_and_files()
-            request.META['REQUEST_METHOD'] = 'PUT'
-        request.PUT = request.POST
-        content = request.PUT.get('content', '')
-        image = request.FILES.get('img_file')
-        video = request.PUT.get('video_link', '')
-
-        # Check the content length
-        if not content or len(content) > 1000:
-            return JsonResponse({
-                "error": ("Your post content must not be empty"
-                          "and cannot exceed 1000 characters.")
-            }, status=400)
-
-        # Update the post or comment fields
-        post.content = content
-        post.thumb = image
-        post.video = video
-        post.save()
-        return JsonResponse(post.serialize())
+        return await sync_to_async(edit_post)(request, post)
 
     # Post must be via GET or PUT
     else:
@@ -379,6 +555,51 @@ def post(request, post_id):
         }, status=400)
 
 
+# Applies an edit sent to the post API route
+def edit_post(request, post):
+
+    # Django only parses POST bodies, so run the upload handlers on
+    # the PUT body directly. Files stream through the hashing
+    # handlers into memory or a temporary file as they are parsed
+    try:
+        if request.content_type == "multipart/form-data":
+            data, files = request.parse_file_upload(request.META, request)
+        else:
+            data, files = QueryDict(request.body), MultiValueDict()
+    except MultiPartParserError:
+        return JsonResponse({"error": "Invalid form data."}, status=400)
+    content = data.get('content', '')
+    image = files.get('img_file')
+    thumb_name = data.get('thumb_name', '')
+    video = data.get('video_link', '')
+
+    # Check that a direct upload exists before attaching it
+    if thumb_name and not uploads.is_stored(thumb_name):
+        return JsonResponse({
+            "error": "The uploaded image was not found."
+        }, status=400)
+
+    # Check the video link
+    try:
+        video = clean_video_link(video)
+    except forms.ValidationError as error:
+        return JsonResponse({"error": error.messages[0]}, status=400)
+
+    # Check the content length
+    if not content or len(content) > 1000:
+        return JsonResponse({
+            "error": ("Your post content must not be empty"
+                      "and cannot exceed 1000 characters.")
+        }, status=400)
+
+    # Update the post or comment fields
+    post.content = content
+    post.thumb = uploads.attach(image, thumb_name)
+    post.video = video
+    post.save()
+    return JsonResponse(post.serialize())
+
+
 # Handles requests to the user API route
 @login_required
 def user(request, username):
@@ -393,27 +614,16 @@ def user(request, username):
     if request.method == "GET":
         return JsonResponse(user.serialize())
 
-    # Update the user's likes field
+    # Toggle the viewer's like on a post
     elif request.method == "PUT":
         data = json.loads(request.body)
         if data.get("post_id") is not None:
-            post = Post.objects.get(pk=data["post_id"])
-
-            # Check if the viewer has already liked the post
-            if post in request.user.likes.all():
-                user.likes.remove(post)
-            else:
-                user.likes.add(post)
-
-        # Update the user's comment likes field
-        elif data.get("comment_id") is not None:
-            comment = Comment.objects.get(pk=data["comment_id"])
-
-            # Check if the viewer has already liked the comment
-            if comment in request.user.comment_likes.all():
-                user.comment_likes.remove(comment)
-            else:
-                user.comment_likes.add(comment)
+            try:
+                post_id = Post.objects.values_list("id", flat=True) \
+                    .get(pk=data["post_id"])
+            except Post.DoesNotExist:
+                return JsonResponse({"error": "Post not found."}, status=404)
+            likes.toggle(request.user, post_id)
         return HttpResponse(status=204)
 
     # User must be via GET or PUT
@@ -423,6 +633,316 @@ def user(request, username):
         }, status=400)
 
 
+# Handles requests to the like API route. POST likes the post and
+# DELETE removes the like. Both are idempotent and respond with the
+# viewer's like state and the post's like count
+@login_required
+async def like(request, post_id):
+
+    # Liking must be via POST or DELETE
+    if request.method not in ("POST", "DELETE"):
+        return JsonResponse({
+            "error": "POST or DELETE request required."
+        }, status=400)
+
+    # Check that the post exists before touching the likes table
+    if not await Post.objects.filter(pk=post_id).aexists():
+        return JsonResponse({"error": "Post not found."}, status=404)
+    user = await request.auser()
+    await likes.aset_liked(user, post_id, request.method == "POST")
+
+    # Read the like back, including it if it is still buffered
+    post = await Post.objects.filter(pk=post_id).with_viewer_liked(user) \
+        .values("id", "viewer_liked", "like_count").aget()
+    likes.apply([post], await likes.apending(user.pk, [post_id]))
+    return JsonResponse({
+        "liked": post["viewer_liked"],
+        "like_count": post["like_count"]
+    })
+
+
+# Handles requests to the follow API route. POST follows the user and
+# DELETE unfollows them. Both are idempotent and respond with the
+# viewer's follow state and both users' counters, read in one query
+@login_required
+async def follow(request, username):
+
+    # Following must be via POST or DELETE
+    if request.method not in ("POST", "DELETE"):
+        return JsonResponse({
+            "error": "POST or DELETE request required."
+        }, status=400)
+
+    # Query for requested user
+    try:
+        author = await User.objects.aget(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "User not found."}, status=404)
+    user = await request.auser()
+    if author.pk == user.pk:
+        return JsonResponse({
+            "error": "Users cannot follow themselves."
+        }, status=400)
+    following = request.method == "POST"
+    await writer.awrite(set_following, user, author, following)
+    counts = {
+        row.pop("pk"): row
+        async for row in User.objects.filter(pk__in=(user.pk, author.pk))
+        .values("pk", "username", "follower_count", "following_count")
+    }
+    return JsonResponse({
+        "following": following,
+        "user": counts[author.pk],
+        "viewer": counts[user.pk]
+    })
+
+
+# Handles requests to the live event routes of boards and threads.
+# Streams server-sent events (see forum/events.py) until the browser
+# disconnects
+async def board_events(request, board_id):
+    if not await Board.objects.filter(pk=board_id).aexists():
+        return JsonResponse({"error": "Board not found."}, status=404)
+    return events_response(request, f"board:{board_id}")
+
+
+async def thread_events(request, post_id):
+    if not await Post.objects.filter(pk=post_id).aexists():
+        return JsonResponse({"error": "Post not found."}, status=404)
+    return events_response(request, f"thread:{post_id}")
+
+
+# Only the ASGI server can hold streams open without tying up a worker
+# thread each, so under WSGI the routes respond 501 and pages go
+# without live updates
+def events_response(request, channel):
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            "error": "Live updates require the ASGI server."
+        }, status=501)
+    response = StreamingHttpResponse(
+        events.stream(channel), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# Number of users per page of the follower and following lists
+FOLLOWS_PER_PAGE = 20
+
+
+# Handles requests to the follower and following list API routes.
+# Returns a page of the users following the given user (followers) or
+# followed by them (following), most recent follows first. Pages are
+# addressed with cursors that seek through the user's follows on the
+# follows table index
+async def follow_list(request, username, direction):
+
+    # Lists must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+
+    # Query for requested user
+    try:
+        user = await User.objects.aget(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "User not found."}, status=404)
+    if direction == "followers":
+        follows, other = Follow.objects.filter(to_user=user), "from_user"
+    else:
+        follows, other = Follow.objects.filter(from_user=user), "to_user"
+    follows = follows.select_related(other).order_by("-id")
+    page_obj = await CursorPaginator(follows, FOLLOWS_PER_PAGE) \
+        .apage(request.GET.get("cursor"))
+    return JsonResponse({
+        "users": [
+            {
+                "username": follow_user.username,
+                "follower_count": follow_user.follower_count,
+                "following_count": follow_user.following_count
+            }
+            for follow_user in (getattr(row, other) for row in page_obj)
+        ],
+        "next": page_obj.next_cursor,
+        "previous": page_obj.previous_cursor
+    })
+
+
+# Default and largest number of posts per page of the versioned API
+# (?limit=)
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+
+# Parse the fields and limit parameters of a versioned API request.
+# Raises ValueError for invalid parameters
+def api_parameters(request):
+    fields = api.parse_fields(request.GET.get("fields"))
+    limit = request.GET.get("limit", "")
+    if not limit:
+        return fields, API_PAGE_SIZE
+    if not limit.isdigit() or not 1 <= int(limit) <= API_MAX_PAGE_SIZE:
+        raise ValueError(
+            f"limit must be between 1 and {API_MAX_PAGE_SIZE}.")
+    return fields, int(limit)
+
+
+# Return a page of posts of the versioned API, read as values() rows
+# and serialized with the requested fields, along with any other data
+async def api_page(request, posts, user, fields, limit, **data):
+    page_obj = await CursorPaginator(
+        api.post_values(posts, fields, user), limit) \
+        .apage(request.GET.get("cursor"))
+    await api.apply_pending_likes(page_obj.object_list, fields, user)
+    return api.json_response(request, {
+        **data,
+        "posts": api.serialize_posts(page_obj, fields),
+        "next": page_obj.next_cursor,
+        "previous": page_obj.previous_cursor
+    })
+
+
+# Handles requests to the version 1 board feed API route. Returns a
+# page of a board's top-level posts, with the sorts of the board page
+async def api_board_posts(request, board_id):
+
+    # Feeds must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    try:
+        fields, limit = api_parameters(request)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    # Query for requested board
+    if not await Board.objects.filter(pk=board_id).aexists():
+        return JsonResponse({"error": "Board not found."}, status=404)
+    sort = request.GET.get("q", "")
+    posts = Post.objects.filter(board_id=board_id, parent=None) \
+        .order_by(*BOARD_SORTS.get(sort, DEFAULT_SORT))
+    return await api_page(
+        request, posts, await request.auser(), fields, limit)
+
+
+# Handles requests to the version 1 thread API route. Returns a post
+# and a page of its replies at every depth, in thread order
+async def api_thread(request, post_id):
+
+    # Threads must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    try:
+        fields, limit = api_parameters(request)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    # Query for requested post
+    user = await request.auser()
+    root = await api.post_values(
+        Post.objects.filter(pk=post_id), fields, user, "path").afirst()
+    if root is None:
+        return JsonResponse({"error": "Post not found."}, status=404)
+    await api.apply_pending_likes([root], fields, user)
+    replies = Post.objects.descendants([Post(path=root["path"])])
+    return await api_page(
+        request, replies, user, fields, limit,
+        post=api.serialize_posts([root], fields)[0])
+
+
+# Handles requests to the version 1 user posts API route. Returns a
+# page of a user's top-level posts, newest first
+async def api_user_posts(request, username):
+
+    # Feeds must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    try:
+        fields, limit = api_parameters(request)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    # Query for requested user
+    author_id = await User.objects.filter(username=username) \
+        .values_list("pk", flat=True).afirst()
+    if author_id is None:
+        return JsonResponse({"error": "User not found."}, status=404)
+    posts = Post.objects.filter(author_id=author_id, parent=None) \
+        .order_by(*DEFAULT_SORT)
+    return await api_page(
+        request, posts, await request.auser(), fields, limit)
+
+
+# Handles requests to the version 1 following feed API route. Returns
+# a page of the signed in user's Following feed
+@login_required
+async def api_following(request):
+
+    # Feeds must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+    try:
+        fields, limit = api_parameters(request)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    user = await request.auser()
+    posts = await sync_to_async(timeline.following_posts)(user)
+    return await api_page(request, posts, user, fields, limit)
+
+
+# Handles requests to the like state API route. Takes a
+# comma-separated list of post IDs (?ids=1,2,3) and returns the
+# viewer's like state and the counters of every post in one query
+@login_required
+async def like_states(request):
+
+    # Like states must be requested via GET
+    if request.method != "GET":
+        return JsonResponse({"error": "GET request required."}, status=400)
+
+    # Parse and bound the list of post IDs
+    try:
+        ids = [int(i) for i in request.GET.get("ids", "").split(",") if i]
+    except ValueError:
+        return JsonResponse({"error": "Invalid post IDs."}, status=400)
+    if len(ids) > 100:
+        return JsonResponse({
+            "error": "At most 100 post IDs may be requested at once."
+        }, status=400)
+    user = await request.auser()
+    posts = [
+        post async for post in Post.objects.filter(pk__in=ids)
+        .with_viewer_liked(user)
+        .values("id", "viewer_liked", "like_count", "comment_count")
+    ]
+
+    # Include the viewer's likes that are still buffered
+    if user.is_authenticated:
+        likes.apply(posts, await likes.apending(user.pk, ids))
+    return JsonResponse({
+        "posts": [
+            {
+                "id": post["id"],
+                "liked": post["viewer_liked"],
+                "like_count": post["like_count"],
+                "comment_count": post["comment_count"]
+            }
+            for post in posts
+        ]
+    })
+
+
+# Save a new comment, incrementing the parent post's comment counter
+# and refreshing its ranking scores in the same transaction
+@transaction.atomic
+def create_comment(comment):
+    comment.save()
+    Post.objects.filter(pk=comment.parent_id) \
+        .update(comment_count=F("comment_count") + 1)
+    Post.objects.filter(pk=comment.parent_id).refresh_scores()
+
+
 # Handles requests to the compose comment API route
 @login_required
 def compose_comment(request, post_id):
@@ -432,6 +952,7 @@ def compose_comment(request, post_id):
         return JsonResponse({"error": "POST request required."}, status=400)
     content = request.POST.get('content', '')
     image = request.FILES.get('img_file')
+    thumb_name = request.POST.get('thumb_name', '')
     video = request.POST.get('video_link', '')
 
     # Check the content length
@@ -441,11 +962,26 @@ def compose_comment(request, post_id):
                       "and cannot exceed 1000 characters.")
         }, status=400)
 
-    # Query for requested post
+    # Check that a direct upload exists before attaching it
+    if thumb_name and not uploads.is_stored(thumb_name):
+        return JsonResponse({
+            "error": "The uploaded image was not found."
+        }, status=400)
+
+    # Check the video link
+    try:
+        video = clean_video_link(video)
+    except forms.ValidationError as error:
+        return JsonResponse({"error": error.messages[0]}, status=400)
+
+    # Query for requested post. Replies to the deepest comments join
+    # their parent's replies
     try:
         post = Post.objects.get(pk=post_id)
     except Post.DoesNotExist:
         return HttpResponse("Error: Post does not exist.")
+    if post.depth >= Post.MAX_DEPTH:
+        post = post.parent
 
     # Create a new comment and save it to the database
     comment = Post(
@@ -453,13 +989,53 @@ def compose_comment(request, post_id):
         board=post.board,
         parent=post,
         content=content,
-        thumb=image,
+        thumb=uploads.attach(image, thumb_name),
         video=video
     )
-    comment.save()
+    writer.write(create_comment, comment)
     return JsonResponse(comment.serialize())
 
 
+# Handles requests to the upload API route. Takes the SHA-256 hash,
+# size, name and content type of an image the browser is about to
+# upload and returns its storage name and, unless an identical image
+# is already stored, where to upload it
+@login_required
+def start_upload(request):
+
+    # Starting an upload must be via POST
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=400)
+    try:
+        data = json.loads(request.body)
+        upload = uploads.start(
+            request,
+            str(data["sha256"]).lower(),
+            int(data["size"]),
+            str(data.get("filename", "")),
+            str(data.get("content_type", "")))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Invalid upload request."}, status=400)
+    except uploads.UploadError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    return JsonResponse(upload)
+
+
+# Handles requests to the upload receive API route, where images are
+# uploaded directly when storage is the local filesystem rather than S3
+@login_required
+def receive_upload(request, token):
+
+    # Uploading a file must be via PUT
+    if request.method != "PUT":
+        return JsonResponse({"error": "PUT request required."}, status=400)
+    try:
+        name = uploads.receive(request, token)
+    except uploads.UploadError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    return JsonResponse({"name": name}, status=201)
+
+
 def login_view(request):
     if request.method == "POST":
 
@@ -490,6 +1066,12 @@ def register(request):
         username = request.POST["username"]
         email = request.POST["email"]
 
+        # Ensure the username does not collide with a fixed route
+        if username.lower() in RESERVED_USERNAMES:
+            return render(request, "forum/register.html", {
+                "message": "Username is reserved."
+            })
+
         # Ensure password matches confirmation
         password = request.POST["password"]
         confirmation = request.POST["confirmation"]
@@ -0,0 +1,76 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+# Single-writer queue for SQLite deployments.
+#
+# SQLite allows one writer at a time. With several Gunicorn threads or
+# an ASGI thread pool writing at once, transactions queue up on the
+# database lock and, past the busy timeout, fail with "database is
+# locked". When FORUM_SERIALIZE_WRITES is set, the busiest write paths
+# (liking, commenting and posting) hand their transaction to one writer
+# thread per process instead, so within a process writes never contend
+# for the lock, and the busy timeout only has to cover the other
+# processes.
+#
+# Jobs run in a copy of the caller's context, so request instrumentation
+# still counts their queries. A job that is already inside a transaction
+# or on the writer thread runs inline, as it has to join that
+# transaction.
+
+_local = threading.local()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+# Return this process's writer, starting it on first use. A forked
+# Gunicorn worker does not inherit its parent's thread, so it starts
+# its own
+def executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="forum-writer")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run(func, args, kwargs):
+    _local.writer = True
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.writer = False
+
+
+def inline():
+    return not settings.FORUM_SERIALIZE_WRITES or \
+        getattr(_local, "writer", False) or connection.in_atomic_block
+
+
+def submit(func, args, kwargs):
+    context = contextvars.copy_context()
+    return executor().submit(context.run, run, func, args, kwargs)
+
+
+# Run func(*args, **kwargs) on the writer thread and return its result,
+# raising its exception if it fails
+def write(func, *args, **kwargs):
+    if inline():
+        return func(*args, **kwargs)
+    return submit(func, args, kwargs).result()
+
+
+# Async version of write() for async views
+async def awrite(func, *args, **kwargs):
+    if not settings.FORUM_SERIALIZE_WRITES:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await asyncio.wrap_future(submit(func, args, kwargs))